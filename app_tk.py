@@ -1,17 +1,19 @@
 # -*- coding: utf-8 -*-
 import time
+T_START = time.perf_counter()  # taken before the heavy imports, for the startup report
+import threading
 import tkinter as tk
 from tkinter import ttk, messagebox
 import tkinter.font as tkfont
 from PIL import Image, ImageTk
-from datetime import datetime, timedelta
 
 import numpy as np
 import cv2
 
 import face_db as db
-import cv_engine as eng
 import config_store as cfgs
+import pipeline as pl
+import metrics
 
 
 def pick_font(root):
@@ -66,23 +68,39 @@ class App:
         self.cooldown_h = tk.DoubleVar(value=float(self.cfg.get("cooldown_hours", 12.0)))
         self.mode = None  # None | \'attendance\' | \'enroll\'
         self.current_page = "attendance"
-        self.last_capture_t = 0.0
+        self.session = 0  # bumped on every Start so the worker resets its capture pacing
         self.enroll_samples = []
         self.is_fullscreen = False
 
         self.cooldown_hours = float(self.cfg.get("cooldown_hours", 12.0))
+        db.set_attendance_backend(self.cfg.get("attendance_backend", "csv"))
         self.last_recorded = db.build_last_records(hours=max(24.0, self.cooldown_hours + 2.0))
 
-        # Camera
-        self.cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
-        if not self.cap.isOpened():
-            messagebox.showerror("Camera", "Camera not found or access denied")
-        self.last_frame = None
+        # Enrolled students, kept in memory for matching
+        self.gallery = db.Gallery.from_config(self.cfg)
+
+        # Camera: opened on a background thread (CAP_DSHOW can take seconds), see _open_camera
+        self.cap = None
+        self._camera_error = False
+
+        # Display buffers reused by _show_frame
+        self._disp_small = None
+        self._disp_rgb = None
 
-        # CV engine cache
-        self.detector = None
-        self.recognizer = None
-        self._detector_score_cache = None
+        # Capture + inference run on background threads; _tick only drains results
+        self.pipeline = pl.Pipeline(None, self.gallery)
+        self.recorder = pl.AttendanceRecorder(self.gallery, self.cfg.get("default_class_name", "OS_Lab"),
+                                              self.cooldown_hours, last_recorded=self.last_recorded,
+                                              stats=self.pipeline.stats)
+
+        # Performance overlay (F3) and periodic metrics files
+        self.show_overlay = bool(self.cfg.get("perf_overlay", False))
+        self._overlay_lines = []
+        self._overlay_t = 0.0
+        self.metrics_writer = None
+        if float(self.cfg.get("metrics_interval_sec", 0.0)) > 0:
+            self.metrics_writer = metrics.MetricsWriter(self.pipeline.stats_snapshot,
+                                                        float(self.cfg["metrics_interval_sec"]))
 
         # ---------- Top bar (turns Red/Green) ----------
         self.top = tk.Frame(root, bg=C_RED)
@@ -113,6 +131,7 @@ class App:
         self.full_btn.pack(side="left", padx=14, pady=(0,10))
 
         self.root.bind("<Escape>", lambda e: self.request_exit_fullscreen())
+        self.root.bind("<F3>", lambda e: self.toggle_overlay())
 
         # ---------- Main area: pages (left) + main menu (right) ----------
         self.main = tk.Frame(root, bg="white")
@@ -156,8 +175,29 @@ class App:
         # Default page: Attendance
         self.show_page("attendance")
         self._update_mode_ui()
+        self.pipeline.set_params(self._frame_params())
+        self.pipeline.start()
+        # models load while the window is already usable; the warm-up waits for the camera's frame size
+        self.pipeline.preload(float(self.score_th_att.get()), int(self.cfg.get("detect_long_side", 0)),
+                              batch_embed=bool(self.cfg.get("batch_embed", True)))
+        threading.Thread(target=self._open_camera, name="camera-open", daemon=True).start()
+        if self.metrics_writer is not None:
+            self.metrics_writer.start()
+        self.pipeline.startup["ui_s"] = time.perf_counter() - T_START
+        self._startup_reported = False
         self._tick()
 
+    def _open_camera(self):
+        cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
+        self.cap = cap
+        if cap.isOpened():
+            size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            self.pipeline.set_frame_size(size if all(size) else None)
+            self.pipeline.capture.cap = cap
+        else:
+            self.pipeline.set_frame_size(None)
+            self._camera_error = True  # reported from _tick (Tk calls belong on the Tk thread)
+
     # ---------- Navigation ----------
     def show_page(self, name: str):
         self.current_page = name
@@ -179,13 +219,15 @@ class App:
                 b.configure(bg="#334155")
 
     # ---------- Engine ----------
-    def ensure_engine(self, face_score_th: float):
-        face_score_th = float(face_score_th)
-        if self.detector is None or self._detector_score_cache is None or abs(self._detector_score_cache - face_score_th) > 1e-6:
-            self.detector = eng.make_detector(score_thresh=face_score_th)
-            self._detector_score_cache = face_score_th
-        if self.recognizer is None:
-            self.recognizer = eng.make_recognizer()
+    def _frame_params(self):
+        """Snapshot of the Tk variables the inference worker needs (Tk vars are not thread-safe)."""
+        enroll = self.mode == "enroll"
+        return pl.frame_params(
+            self.cfg, self.mode, self.session,
+            face_score=float(self.score_th_enroll.get()) if enroll else float(self.score_th_att.get()),
+            interval=float(self.enroll_interval.get()) if enroll else None,
+            sim_th=float(self.sim_th.get()),
+        )
 
     # ---------- Layout helpers ----------
     def _make_split(self, parent):
@@ -387,7 +429,7 @@ class App:
         tk.Button(btns, text="Delete Selected", command=self.delete_selected, bg=C_RED, fg="white",
                   relief="flat", padx=10, pady=6).pack(side="left")
 
-        self.students_lb = tk.Listbox(col1, height=18, font=("Consolas", 12))
+        self.students_lb = tk.Listbox(col1, height=18, font=("Consolas", 12), selectmode=tk.EXTENDED)
         self.students_lb.pack(fill="both", expand=True)
 
         col2 = tk.Frame(sec, bg=C_PANEL, width=420)
@@ -423,6 +465,7 @@ class App:
         self.cfg_interval = tk.DoubleVar(value=float(self.cfg.get("capture_interval_sec",2.0)))
         self.cfg_enroll_n = tk.IntVar(value=int(self.cfg.get("enroll_samples_target",10)))
         self.cfg_cool_h = tk.DoubleVar(value=float(self.cfg.get("cooldown_hours",24.0)))
+        self.cfg_detect_side = tk.IntVar(value=int(self.cfg.get("detect_long_side",0)))
 
         # Grid layout (avoid diagonal / messy alignment)
         form.grid_columnconfigure(0, weight=1)
@@ -451,6 +494,10 @@ class App:
         cooldown_spin = ttk.Spinbox(form, from_=1, to=48, increment=1, textvariable=self.cfg_cool_h, width=9, justify="left")
         grid_row(5, "Cooldown (hours)", cooldown_spin)
 
+        # 0 = detect on the full frame; smaller = faster but shorter detection range
+        detect_combo = ttk.Combobox(form, textvariable=self.cfg_detect_side, values=[0, 320, 480, 640, 960], width=9)
+        grid_row(6, "Detection size (px)", detect_combo)
+
         tk.Button(st_box, text="Save", command=self.save_settings, bg="#1976d2", fg="white",
                   relief="flat", padx=12, pady=8)\
             .pack(anchor="e", padx=10, pady=(0,10))
@@ -481,9 +528,8 @@ class App:
 
     def refresh_students(self):
         self.students_lb.delete(0, tk.END)
-        meta = db.load_meta()
-        for sid, info in sorted(meta.items(), key=lambda x: x[0]):
-            n = db.load_features(sid).shape[0]
+        for sid, info in sorted(self.gallery.meta.items(), key=lambda x: x[0]):
+            n = self.gallery.sample_count(sid)
             name = info.get("name","")
             cls = info.get("class","")
             self.students_lb.insert(tk.END, f"{sid} | {name} | Class={cls} | samples={n}")
@@ -492,10 +538,11 @@ class App:
         sel = self.students_lb.curselection()
         if not sel:
             return
-        item = self.students_lb.get(sel[0])
-        sid = item.split("|")[0].strip()
-        if messagebox.askyesno("Delete", f"Delete permanently?\n{sid}"):
-            db.delete_student(sid, delete_logs=True)
+        sids = [self.students_lb.get(i).split("|")[0].strip() for i in sel]
+        shown = "\n".join(sids[:10]) + (f"\n... (+{len(sids) - 10})" if len(sids) > 10 else "")
+        if messagebox.askyesno("Delete", f"Delete permanently?\n{shown}"):
+            db.delete_students(sids, delete_logs=True)
+            self.gallery.remove_many(sids)
             self.refresh_students()
 
     def refresh_classes_ui(self):
@@ -549,6 +596,7 @@ class App:
             self.classes.insert(0, default_class)
 
         cfgs.save_config({
+            **self.cfg,
             "default_class_name": default_class,
             "classes": self.classes,
             "default_similarity_threshold": float(self.cfg_sim.get()),
@@ -556,6 +604,7 @@ class App:
             "capture_interval_sec": float(self.cfg_interval.get()),
             "enroll_samples_target": int(self.cfg_enroll_n.get()),
             "cooldown_hours": float(self.cfg_cool_h.get()),
+            "detect_long_side": int(self.cfg_detect_side.get()),
         })
         self.cfg = cfgs.load_config()
         self.classes = list(self.cfg.get("classes", self.classes))
@@ -575,8 +624,6 @@ class App:
         self.cooldown_h.set(float(self.cfg.get("cooldown_hours",12.0)))
         self.cooldown_hours = float(self.cfg.get("cooldown_hours",12.0))
 
-        self.detector = None
-        self._detector_score_cache = None
         messagebox.showinfo("Admin", "Saved")
 
     # ---------- UI state ----------
@@ -652,11 +699,11 @@ class App:
             self.mode = None
             self._set_att_banner("Stopped", "warn", sid="—", name="—", cls="—")
         else:
-            if not db.load_meta():
+            if len(self.gallery) == 0:
                 self._set_att_banner("No enrolled students yet", "err", sid="—", name="—", cls="—")
                 return
             self.mode = "attendance"
-            self.last_capture_t = 0.0
+            self.session += 1
             self._set_att_banner("Attendance started. Students may walk in front of the camera.", "info", sid="—", name="—", cls="—")
         self._update_mode_ui()
 
@@ -681,8 +728,7 @@ class App:
             self._set_enroll_banner("Enter Full Name", "err")
             return
 
-        meta = db.load_meta()
-        if sid in meta:
+        if sid in self.gallery.meta:
             self._set_enroll_banner("This Student ID is already enrolled", "warn")
             return
 
@@ -693,92 +739,21 @@ class App:
 
         self.mode = "enroll"
         self.enroll_samples = []
-        self.last_capture_t = 0.0
+        self.session += 1
         self.enroll_progress.configure(value=0)
         self._set_enroll_banner("Enrollment started. Please face the camera.", "info")
         self._update_mode_ui()
 
-    # ---------- Matching ----------
-    def best_match(self, feat: np.ndarray, threshold: float):
-        meta = db.load_meta()
-        best_id = None
-        best_sim = -1.0
-        for sid in meta.keys():
-            feats = db.load_features(sid)
-            if feats.shape[0] == 0:
-                continue
-            sims = [eng.cosine_sim(self.recognizer, feat, f) for f in feats]
-            s = float(np.max(sims))
-            if s > best_sim:
-                best_sim = s
-                best_id = sid
-        if best_sim >= threshold:
-            return best_id, best_sim
-        return None, best_sim
-
-    def _process_frame(self, bgr):
-        face_score = float(self.score_th_enroll.get()) if self.mode == "enroll" else float(self.score_th_att.get())
-        self.ensure_engine(face_score)
-
-        # --- Feature extraction ---
-        if self.mode == "attendance":
-            faces_mat = eng.detect_faces(self.detector, bgr)
-            if faces_mat is None or len(faces_mat) == 0:
-                return bgr, [], "NO_FACE"
-
-            # filter by detector score (index 4 is confidence)
-            faces = []
-            for row in faces_mat:
-                try:
-                    if float(row[4]) >= face_score:
-                        faces.append(row)
-                except Exception:
-                    faces.append(row)
-
-            if len(faces) == 0:
-                faces = list(faces_mat)
-
-            # prefer largest faces, cap to keep CPU reasonable
-            faces = sorted(faces, key=lambda r: float(r[2] * r[3]), reverse=True)[:5]
-
-            feats = []
-            disp = bgr.copy()
-            for row in faces:
-                aligned = self.recognizer.alignCrop(bgr, row)
-                feat = self.recognizer.feature(aligned)
-                feat = np.asarray(feat, dtype=np.float32).reshape(-1)
-                feats.append(feat)
-                disp = eng.draw_face_box(disp, row, color=(0, 255, 0))
-            code = "OK"
-        else:
-            feat, face_row, code = eng.extract_feature(self.detector, self.recognizer, bgr)
-            disp = eng.draw_face_box(bgr, face_row, color=(0,255,0) if code=="OK" else (0,0,255))
-            if code != "OK":
-                return disp, None, code
-            feats = feat
-
-        # --- Rate limit captures ---
-        now = time.time()
-        interval = float(self.enroll_interval.get()) if self.mode=="enroll" else float(self.cfg.get("capture_interval_sec", 2.0))
-        if now - self.last_capture_t < interval:
-            return disp, feats, "OK_WAIT"
-
-        self.last_capture_t = now
-        return disp, feats, "OK_CAPTURE"""
-
     def _finalize_enroll(self):
         sid = _s(self.enroll_id.get())
         name = _s(self.enroll_name.get())
         cls = self.enroll_class.get() or self.cfg.get("default_class_name","OS_Lab")
 
-        meta = db.load_meta()
-        if sid in meta:
+        feats = np.stack(self.enroll_samples)
+        info = db.add_student(sid, name, cls, feats)
+        if info is None:
             return False
-
-        meta[sid] = {"name": name, "class": cls}
-        for f in self.enroll_samples:
-            db.append_feature(sid, f)
-        db.save_meta(meta)
+        self.gallery.add(sid, feats, info=info)
         try:
             self.refresh_students()
         except Exception:
@@ -801,27 +776,20 @@ class App:
             self.mode = None
             self._update_mode_ui()
 
-    def _attendance_step(self, feat):
-        th = float(self.sim_th.get())
-        meta = db.load_meta()
+    def _attendance_batch(self, matches):
+        for sid, sim, _margin in matches:
+            self._attendance_step(sid, sim)
 
-        sid, sim = self.best_match(feat, th)
-        if sid is None:
+    def _attendance_step(self, sid, sim):
+        self.recorder.cooldown_hours = float(self.cooldown_h.get())
+        self.recorder.default_class = self.cfg.get("default_class_name", "OS_Lab")
+        ev = self.recorder.record(sid, sim)
+        if ev["status"] == "UNKNOWN":
             self._set_att_banner(f"Unknown (best={sim:.3f})", "warn", sid="—", name="—", cls="—")
-            return
-
-        cls = meta.get(sid, {}).get("class", self.cfg.get("default_class_name","OS_Lab"))
-        name = meta.get(sid, {}).get("name","")
-
-        hours = float(self.cooldown_h.get())
-        last = self.last_recorded.get(sid)
-        if last is not None and datetime.now() - last < timedelta(hours=hours):
-            self._set_att_banner("Already recorded (cooldown)", "info", sid=sid, name=name, cls=cls)
-            return
-
-        db.append_attendance_row(cls, sid, name, sim)
-        self.last_recorded[sid] = datetime.now()
-        self._set_att_banner("Attendance recorded", "ok", sid=sid, name=name, cls=cls)
+        elif ev["status"] == "COOLDOWN":
+            self._set_att_banner("Already recorded (cooldown)", "info", sid=sid, name=ev["name"], cls=ev["class"])
+        else:
+            self._set_att_banner("Attendance recorded", "ok", sid=sid, name=ev["name"], cls=ev["class"])
 
     # ---------- Video ----------
     def _active_video_label(self):
@@ -839,40 +807,97 @@ class App:
         w = max(lbl.winfo_width(), 760)
         h = max(lbl.winfo_height(), 540)
 
-        rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
-        ih, iw = rgb.shape[:2]
+        ih, iw = bgr.shape[:2]
         scale = min(w / iw, h / ih)
-        nw, nh = int(iw * scale), int(ih * scale)
-        rgb2 = cv2.resize(rgb, (max(1,nw), max(1,nh)))
-        img = Image.fromarray(rgb2)
-        imgtk = ImageTk.PhotoImage(image=img)
-        lbl.imgtk = imgtk
-        lbl.configure(image=imgtk)
+        nw, nh = max(1, int(iw * scale)), max(1, int(ih * scale))
+
+        # Resize first (fewer pixels to convert), then BGR->RGB; both into buffers reused across frames
+        if self._disp_small is None or self._disp_small.shape[:2] != (nh, nw):
+            self._disp_small = np.empty((nh, nw, 3), dtype=np.uint8)
+            self._disp_rgb = np.empty((nh, nw, 3), dtype=np.uint8)
+        cv2.resize(bgr, (nw, nh), dst=self._disp_small)
+        cv2.cvtColor(self._disp_small, cv2.COLOR_BGR2RGB, dst=self._disp_rgb)
+        if self.show_overlay:
+            self._draw_overlay(self._disp_rgb)
+        img = Image.fromarray(self._disp_rgb)
+
+        imgtk = getattr(lbl, "imgtk", None)
+        if imgtk is not None and (imgtk.width(), imgtk.height()) == (nw, nh):
+            imgtk.paste(img)
+        else:
+            imgtk = ImageTk.PhotoImage(image=img)
+            lbl.imgtk = imgtk
+            lbl.configure(image=imgtk)
+
+    # ---------- Performance overlay ----------
+    def toggle_overlay(self):
+        self.show_overlay = not self.show_overlay
+        self._overlay_t = 0.0
+
+    def _draw_overlay(self, rgb):
+        now = time.perf_counter()
+        if now - self._overlay_t >= 1.0:  # percentiles are recomputed once a second, not per frame
+            self._overlay_lines = metrics.overlay_lines(self.pipeline.stats_snapshot())
+            self._overlay_t = now
+        for i, line in enumerate(self._overlay_lines):
+            org = (8, 18 + 16 * i)
+            cv2.putText(rgb, line, org, cv2.FONT_HERSHEY_PLAIN, 1.0, (0, 0, 0), 3, cv2.LINE_AA)
+            cv2.putText(rgb, line, org, cv2.FONT_HERSHEY_PLAIN, 1.0, (255, 255, 0), 1, cv2.LINE_AA)
+
+    def _handle_result(self, r):
+        # Results computed for a previous mode/session are only displayed
+        if r["mode"] != self.mode or r["session"] != self.session:
+            return
+        if r["code"] == "ERROR":
+            if self.mode == "enroll":
+                self._set_enroll_banner(f"Error: {r.get('error','')}", "err")
+            else:
+                self._set_att_banner(f"Error: {r.get('error','')}", "err")
+            return
+        if r["code"] != "OK_CAPTURE":
+            return
+        if self.mode == "enroll":
+            self._enroll_step(r["feats"])
+        else:
+            self._attendance_batch(r["matches"])
+
+    def _track_startup(self, frame_shown: bool):
+        st = self.pipeline.startup
+        if frame_shown and "first_frame_s" not in st:
+            st["first_frame_s"] = time.perf_counter() - T_START
+        loader = self.pipeline.loader
+        if loader is not None and loader.done.is_set() and "ready_s" not in st:
+            st["ready_s"] = time.perf_counter() - T_START
+            st["model_load_s"], st["warmup_s"] = loader.load_s, loader.warmup_s
+            if loader.error:
+                self._set_att_banner(f"Error: {loader.error}", "err")
+        if not self._startup_reported and "ready_s" in st and ("first_frame_s" in st or self._camera_error):
+            self._startup_reported = True
+            first = f"{st['first_frame_s']:.2f}s" if "first_frame_s" in st else "-"
+            print(f"Startup: window {st['ui_s']:.2f}s, first frame {first}, ready {st['ready_s']:.2f}s "
+                  f"(models {st['model_load_s']:.2f}s + warm-up {st['warmup_s']:.2f}s)")
 
     def _tick(self):
-        if self.cap is not None and self.cap.isOpened():
-            ret, frame = self.cap.read()
-            if ret:
-                self.last_frame = frame
-
-        if self.last_frame is not None:
-            bgr = self.last_frame
-            if self.mode in ("enroll","attendance"):
-                disp, feat, code = self._process_frame(bgr)
-                if code == "OK_CAPTURE":
-                    if self.mode == "enroll":
-                        self._enroll_step(feat)
-                    else:
-                        if isinstance(feat, list):
-                            for f in feat:
-                                self._attendance_step(f)
-                        else:
-                            self._attendance_step(feat)
-            else:
-                disp = self.last_frame
-            self._show_frame(disp)
+        self.pipeline.set_params(self._frame_params())
+        if self._camera_error:
+            self._camera_error = False
+            messagebox.showerror("Camera", "Camera not found or access denied")
+
+        last = None
+        for r in self.pipeline.drain():
+            self._handle_result(r)
+            last = r
 
-        self.root.after(30, self._tick)
+        if last is not None:
+            t0 = time.perf_counter()
+            self._show_frame(last["frame"])
+            t1 = time.perf_counter()
+            self.pipeline.stats["display"].add(t1 - t0)
+            self.pipeline.stats["end_to_end"].add(t1 - last["t_frame"])
+        if not self._startup_reported:
+            self._track_startup(last is not None)
+
+        self.root.after(self.pipeline.scheduler.display_interval_ms(), self._tick)
 
     # ---------- Fullscreen ----------
     def toggle_fullscreen(self):
@@ -916,6 +941,18 @@ class App:
 
     # ---------- Exit ----------
     def on_close(self):
+        try:
+            self.pipeline.stop()
+        except Exception:
+            pass
+        if self.metrics_writer is not None:
+            self.metrics_writer.stop()
+            try:
+                self.metrics_writer.write_once()
+            except Exception:
+                pass
+        # make sure buffered attendance rows reach the disk
+        db.close_attendance()
         try:
             if self.cap is not None:
                 self.cap.release()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Optional SQLite attendance backend (enable with "attendance_backend": "sqlite" in config.json).
+face_db.append_attendance_row() keeps the same interface; this module only stores the rows.
+
+CLI:
+  python attendance_db.py export <out_dir>   # per-class, per-Jalali-day CSVs (same layout as attendance_logs/)
+  python attendance_db.py import             # load existing attendance_logs/*.csv into the database
+                                             # (rows already in the database are skipped, so re-running is safe)
+"""
+import argparse
+import csv
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+import face_db as db
+
+DB_PATH = db.LOG_DIR / "attendance.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS attendance (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    jalali_date TEXT NOT NULL,
+    class TEXT NOT NULL,
+    student_id TEXT NOT NULL,
+    name TEXT,
+    cosine_similarity REAL
+);
+CREATE INDEX IF NOT EXISTS idx_attendance_student_ts ON attendance (student_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_attendance_class_day ON attendance (class, jalali_date);
+"""
+
+# One row per (timestamp, student, class): makes `import` idempotent. Databases created before
+# the index existed may already hold duplicates from a repeated import; those are dropped first.
+_UNIQUE = "CREATE UNIQUE INDEX idx_attendance_unique ON attendance (timestamp, student_id, class)"
+_DEDUPE = ("DELETE FROM attendance WHERE id NOT IN "
+           "(SELECT MIN(id) FROM attendance GROUP BY timestamp, student_id, class)")
+
+_INSERT = ("INSERT OR IGNORE INTO attendance (timestamp, jalali_date, class, student_id, name, cosine_similarity) "
+           "VALUES (?, ?, ?, ?, ?, ?)")
+
+
+class SQLiteAttendanceStore:
+    def __init__(self, path: Path = DB_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+        if not self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_attendance_unique'").fetchone():
+            self.conn.execute(_DEDUPE)
+            self.conn.execute(_UNIQUE)
+        self.conn.commit()
+
+    def append(self, timestamp: str, jalali_date: str, class_name: str, sid: str, name: str, similarity: float):
+        with self._lock:
+            self.conn.execute(
+                _INSERT,
+                (timestamp, jalali_date, class_name, str(sid), name, float(similarity)),
+            )
+            self.conn.commit()
+
+    def append_many(self, rows) -> int:
+        """rows: iterables in ATTENDANCE_COLUMNS order. -> rows inserted (duplicates are skipped)."""
+        with self._lock:
+            before = self.conn.total_changes
+            self.conn.executemany(_INSERT, rows)
+            self.conn.commit()
+            return self.conn.total_changes - before
+
+    def last_seen(self) -> dict:
+        """{student_id: newest timestamp} (served from the (student_id, timestamp) index)."""
+        with self._lock:
+            cur = self.conn.execute("SELECT student_id, MAX(timestamp) FROM attendance GROUP BY student_id")
+            return {sid: ts for sid, ts in cur.fetchall()}
+
+    def last_seen_for(self, sid: str):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT timestamp FROM attendance WHERE student_id = ? ORDER BY timestamp DESC LIMIT 1", (str(sid),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def rows_for_class(self, class_name: str, from_jalali: str, to_jalali: str):
+        """All rows of a class between two Jalali dates (inclusive, "YYYY-MM-DD")."""
+        with self._lock:
+            cur = self.conn.execute(
+                "SELECT timestamp, jalali_date, class, student_id, name, cosine_similarity FROM attendance "
+                "WHERE class = ? AND jalali_date BETWEEN ? AND ? ORDER BY timestamp",
+                (class_name, from_jalali, to_jalali),
+            )
+            return cur.fetchall()
+
+    def delete_students(self, sids) -> int:
+        sids = [str(s) for s in sids]
+        if not sids:
+            return 0
+        with self._lock:
+            cur = self.conn.execute(
+                f"DELETE FROM attendance WHERE student_id IN ({','.join('?' * len(sids))})", sids
+            )
+            self.conn.commit()
+            return cur.rowcount
+
+    def export_csv(self, out_dir: Path) -> list:
+        """Write one CSV per (class, Jalali day), named like attendance_logs/<class>_<date>.csv."""
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        written = []
+        with self._lock:
+            cur = self.conn.execute(
+                "SELECT timestamp, jalali_date, class, student_id, name, cosine_similarity FROM attendance "
+                "ORDER BY class, jalali_date, timestamp, id"
+            )
+            f = None
+            key = None
+            try:
+                for row in cur:
+                    if (row[2], row[1]) != key:
+                        if f is not None:
+                            f.close()
+                        key = (row[2], row[1])
+                        p = out_dir / f"{db.safe_class_name(row[2])}_{row[1]}.csv"
+                        f = open(p, "w", newline="", encoding="utf-8")
+                        w = csv.writer(f, lineterminator=os.linesep)
+                        w.writerow(db.ATTENDANCE_COLUMNS)
+                        written.append(p)
+                    w.writerow(row)
+            finally:
+                if f is not None:
+                    f.close()
+        return written
+
+    def import_csv_logs(self, log_dir: Path = db.LOG_DIR):
+        """-> (rows read, rows inserted); rows already in the database are not inserted again."""
+        rows = []
+        for p in sorted(Path(log_dir).glob("*.csv")):
+            with open(p, newline="", encoding="utf-8") as f:
+                for r in csv.DictReader(f):
+                    try:
+                        rows.append(tuple(r[c] for c in db.ATTENDANCE_COLUMNS))
+                    except KeyError:
+                        break
+        return len(rows), self.append_many(rows)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="SQLite attendance store tools")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ex = sub.add_parser("export", help="export per-class, per-day CSV files")
+    ex.add_argument("out_dir")
+    sub.add_parser("import", help="import attendance_logs/*.csv into the database")
+    args = ap.parse_args()
+
+    store = SQLiteAttendanceStore()
+    try:
+        if args.cmd == "export":
+            paths = store.export_csv(Path(args.out_dir))
+            print(f"Exported {len(paths)} file(s) -> {args.out_dir}")
+        else:
+            n_read, n_new = store.import_csv_logs()
+            print(f"Imported {n_new} of {n_read} row(s) -> {store.path} ({n_read - n_new} already present)")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Resident gallery precision benchmark: float32 vs float16 vs int8.
+
+  python bench_quantization.py                          # synthetic gallery
+  python bench_quantization.py --students 20000 --samples 10
+  python bench_quantization.py --real                   # the enrolled faces_db
+
+For each dtype it reports the resident matrix size, the match latency per probe
+batch, the largest similarity error, and how many top-1 decisions (student or
+"unknown" at default_similarity_threshold) differ from float32.
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import config_store as cfgs
+import face_db as db
+import gallery_index as gi
+
+
+def synthetic_blocks(n_students: int, samples: int, spread: float, rng) -> dict:
+    """Students are random unit directions; samples are noisy copies of them."""
+    base = rng.normal(size=(n_students, db.FEAT_DIM)).astype(np.float32)
+    feats = np.repeat(base, samples, axis=0) + spread * rng.normal(size=(n_students * samples, db.FEAT_DIM))
+    feats = db.l2_normalize(feats)
+    return {f"S{i:06d}": feats[i * samples:(i + 1) * samples] for i in range(n_students)}
+
+
+def make_probes(blocks: dict, n_probes: int, spread: float, rng) -> np.ndarray:
+    """Half noisy copies of enrolled samples, half unknown faces."""
+    mat = np.concatenate(list(blocks.values()), axis=0)
+    known = mat[rng.integers(0, mat.shape[0], n_probes - n_probes // 2)]
+    known = known + spread * rng.normal(size=known.shape) / np.sqrt(db.FEAT_DIM)
+    unknown = rng.normal(size=(n_probes // 2, db.FEAT_DIM))
+    return db.l2_normalize(np.concatenate([known, unknown], axis=0))
+
+
+def time_match(g: db.Gallery, probes: np.ndarray, threshold: float, batch: int, repeat: int):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = []
+        for s in range(0, probes.shape[0], batch):
+            out.extend(g.match_batch(probes[s:s + batch], threshold))
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return out, best
+
+
+def main():
+    cfg = cfgs.load_config()
+    ap = argparse.ArgumentParser(description="Compare float32 / float16 / int8 resident galleries")
+    ap.add_argument("--real", action="store_true", help="use the enrolled faces_db instead of synthetic data")
+    ap.add_argument("--students", type=int, default=5000)
+    ap.add_argument("--samples", type=int, default=10, help="samples per synthetic student")
+    ap.add_argument("--spread", type=float, default=0.6, help="synthetic within-student noise")
+    ap.add_argument("--probes", type=int, default=1000)
+    ap.add_argument("--batch", type=int, default=5, help="faces matched per call (faces per frame)")
+    ap.add_argument("--repeat", type=int, default=3, help="best-of timing runs")
+    ap.add_argument("--index", default=cfg.get("match_index", "exact"), choices=gi.INDEX_KINDS)
+    ap.add_argument("--threshold", type=float, default=float(cfg.get("default_similarity_threshold", 0.55)))
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.real:
+        blocks = db.Gallery.load().blocks()
+        if not blocks:
+            print("faces_db is empty")
+            return 1
+    else:
+        blocks = synthetic_blocks(args.students, args.samples, args.spread, rng)
+    probes = make_probes(blocks, args.probes, args.spread, rng)
+    n_rows = sum(b.shape[0] for b in blocks.values())
+    print(f"{len(blocks)} student(s), {n_rows} sample(s), {probes.shape[0]} probe(s), "
+          f"index={args.index}, threshold={args.threshold:.2f}")
+    print(f"{'dtype':<8} {'memory MB':>10} {'ms/batch':>9} {'max |dsim|':>11} {'top-1 changed':>14}")
+
+    ref = None
+    for dtype in gi.EMBED_DTYPES:
+        g = db.Gallery.from_blocks(blocks, index=args.index, dtype=dtype)
+        g.wait_for_index()
+        out, dt = time_match(g, probes, args.threshold, args.batch, args.repeat)
+        n_batches = -(-probes.shape[0] // args.batch)
+        if ref is None:
+            ref = out
+        changed = sum(1 for a, b in zip(out, ref) if a[0] != b[0])
+        err = max(abs(a[1] - b[1]) for a, b in zip(out, ref))
+        print(f"{dtype:<8} {g.mat.nbytes / 2**20:>10.2f} {dt / n_batches * 1e3:>9.3f} {err:>11.5f} "
+              f"{changed:>7} ({changed / len(out):.2%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
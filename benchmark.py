@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks for the matching, storage and logging hot paths.
+
+  python benchmark.py run --sizes 100x5,1000x10,5000x10 --out bench.json
+  python benchmark.py compare old.json new.json --tolerance 0.15
+
+`run` builds each synthetic gallery (N students x M 128-d samples) in the real
+faces_db layout, plus a synthetic attendance_logs history, inside a temporary
+directory, then times the face_db functions used by the app. `compare` lists the
+operations whose median got slower than `tolerance` and exits with 1 if any did.
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+import config_store as cfgs
+import face_db as db
+
+CLASS_NAME = "Bench_Class"
+
+
+def parse_sizes(text: str):
+    """"100x5,1000x10" -> [(100, 5), (1000, 10)]"""
+    out = []
+    for part in text.split(","):
+        n, _, m = part.strip().lower().partition("x")
+        out.append((int(n), int(m or 1)))
+    return out
+
+
+def synth_gallery(n_students: int, samples: int, rng):
+    base = rng.normal(size=(n_students, db.FEAT_DIM)).astype(np.float32)
+    records = []
+    for i in range(n_students):
+        feats = base[i] + 0.6 * rng.normal(size=(samples, db.FEAT_DIM)).astype(np.float32)
+        records.append((f"S{i:06d}", f"Student {i}", CLASS_NAME, feats))
+    db.add_students(records)
+    return base
+
+
+def synth_logs(sids: list, days: int, rows_per_day: int, rng):
+    """One attendance CSV per day, named and laid out like the app writes them."""
+    today = datetime.now().replace(hour=8, minute=0, second=0, microsecond=0)
+    for d in range(days):
+        day = today - timedelta(days=d)
+        jalali = db.jalali_date_str(day)
+        p = db.LOG_DIR / f"{db.safe_class_name(CLASS_NAME)}_{jalali}.csv"
+        offsets = np.sort(rng.integers(0, 8 * 3600, rows_per_day))
+        who = rng.integers(0, len(sids), rows_per_day)
+        with open(p, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f, lineterminator=os.linesep)
+            w.writerow(db.ATTENDANCE_COLUMNS)
+            for off, i in zip(offsets, who):
+                ts = (day + timedelta(seconds=int(off))).strftime("%Y-%m-%d %H:%M:%S")
+                w.writerow([ts, jalali, CLASS_NAME, sids[i], f"Student {i}", f"{rng.uniform(0.5, 0.9):.4f}"])
+
+
+def timed(fn, repeat: int):
+    """Call fn(i) for i in range(repeat) and summarize the wall times."""
+    samples = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    a = np.asarray(samples)
+    return {
+        "n": int(a.size),
+        "median_ms": float(np.median(a)),
+        "p95_ms": float(np.percentile(a, 95)),
+        "min_ms": float(a.min()),
+        "mean_ms": float(a.mean()),
+    }
+
+
+def bench_size(n_students: int, samples: int, args, rng) -> dict:
+    work = Path(tempfile.mkdtemp(prefix="fa_bench_"))
+    old_dirs = (db.DB_DIR, db.LOG_DIR)
+    try:
+        db.set_data_dirs(work / "faces_db", work / "attendance_logs")
+        t0 = time.perf_counter()
+        base = synth_gallery(n_students, samples, rng)
+        sids = [f"S{i:06d}" for i in range(n_students)]
+        synth_logs(sids, args.log_days, args.rows_per_day, rng)
+        setup_s = time.perf_counter() - t0
+
+        r = args.repeat
+        ops = {"gallery_load": timed(lambda i: db.Gallery.load(), max(1, r // 10))}
+        g = db.Gallery.load()
+        probes = base[rng.integers(0, n_students, r)] + 0.6 * rng.normal(size=(r, db.FEAT_DIM))
+        ops["best_match"] = timed(lambda i: g.match(probes[i], args.threshold), r)
+        pick = rng.integers(0, n_students, r)
+        ops["load_features"] = timed(lambda i: db.load_features(sids[pick[i]]), r)
+        new = rng.normal(size=(r, db.FEAT_DIM)).astype(np.float32)
+        ops["append_feature"] = timed(lambda i: db.append_feature(sids[pick[i]], new[i]), r)
+
+        def cold_last_records(i):
+            db.drop_last_seen()
+            db.build_last_records(hours=24 * args.log_days)
+
+        ops["build_last_records_cold"] = timed(cold_last_records, max(1, r // 10))
+        ops["build_last_records"] = timed(lambda i: db.build_last_records(hours=24 * args.log_days), r)
+        ops["append_attendance_row"] = timed(
+            lambda i: db.append_attendance_row(CLASS_NAME, sids[pick[i]], "Bench", 0.75), r)
+        ops["flush_attendance"] = timed(lambda i: db.flush_attendance(fsync=True), 1)
+        victims = sids[-max(1, min(args.deletes, n_students)):]
+        ops["delete_student"] = timed(lambda i: db.delete_student(victims[i]), len(victims))
+        db.close_attendance()
+        return {"students": n_students, "samples": samples, "setup_s": round(setup_s, 3), "ops": ops}
+    finally:
+        db.set_data_dirs(*old_dirs)
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def cmd_run(args) -> int:
+    rng = np.random.default_rng(args.seed)
+    report = {
+        "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "params": {"repeat": args.repeat, "log_days": args.log_days, "rows_per_day": args.rows_per_day,
+                   "deletes": args.deletes, "threshold": args.threshold, "seed": args.seed},
+        "results": [],
+    }
+    for n, m in parse_sizes(args.sizes):
+        res = bench_size(n, m, args, rng)
+        report["results"].append(res)
+        print(f"{n} x {m} (setup {res['setup_s']:.1f}s)")
+        for op, st in res["ops"].items():
+            print(f"  {op:<26} median {st['median_ms']:9.3f} ms   p95 {st['p95_ms']:9.3f} ms   n={st['n']}")
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text, encoding="utf-8")
+        print(f"Report -> {args.out}")
+    else:
+        print(text)
+    return 0
+
+
+def _index(report: dict) -> dict:
+    return {(r["students"], r["samples"], op): st for r in report["results"] for op, st in r["ops"].items()}
+
+
+def cmd_compare(args) -> int:
+    old = _index(json.loads(Path(args.old).read_text(encoding="utf-8")))
+    new = _index(json.loads(Path(args.new).read_text(encoding="utf-8")))
+    regressions = 0
+    for key in sorted(set(old) & set(new)):
+        a, b = old[key]["median_ms"], new[key]["median_ms"]
+        ratio = b / a if a > 0 else float("inf")
+        slower = ratio > 1.0 + args.tolerance and (b - a) > args.min_ms
+        regressions += slower
+        flag = "REGRESSION" if slower else ("faster" if ratio < 1.0 - args.tolerance else "")
+        print(f"{key[0]:>7}x{key[1]:<3} {key[2]:<26} {a:9.3f} -> {b:9.3f} ms  x{ratio:5.2f}  {flag}")
+    for key in sorted(set(old) ^ set(new)):
+        print(f"{key[0]:>7}x{key[1]:<3} {key[2]:<26} only in {'old' if key in old else 'new'} report")
+    print(f"{regressions} regression(s) (tolerance {args.tolerance:.0%}, noise floor {args.min_ms} ms)")
+    return 1 if regressions else 0
+
+
+def main():
+    cfg = cfgs.load_config()
+    ap = argparse.ArgumentParser(description="Face attendance micro-benchmarks")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    run = sub.add_parser("run", help="run the scaling sweep and write a JSON report")
+    run.add_argument("--sizes", default="100x5,1000x10,5000x10", help="comma separated <students>x<samples>")
+    run.add_argument("--repeat", type=int, default=200, help="timed calls per operation")
+    run.add_argument("--log-days", type=int, default=30, help="days of synthetic attendance history")
+    run.add_argument("--rows-per-day", type=int, default=300)
+    run.add_argument("--deletes", type=int, default=5, help="students deleted at the end of each size")
+    run.add_argument("--threshold", type=float, default=float(cfg.get("default_similarity_threshold", 0.55)))
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--out", help="report path (default: print)")
+    cmp_ = sub.add_parser("compare", help="compare two reports and flag regressions")
+    cmp_.add_argument("old")
+    cmp_.add_argument("new")
+    cmp_.add_argument("--tolerance", type=float, default=0.15, help="allowed median slowdown (0.15 = 15%%)")
+    cmp_.add_argument("--min-ms", type=float, default=0.05, help="ignore differences below this many ms")
+    args = ap.parse_args()
+    return cmd_run(args) if args.cmd == "run" else cmd_compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk offline enrollment from existing photos.
+
+  python bulk_enroll.py --dir photos/             # photos/<sid>_<name>/*.jpg
+  python bulk_enroll.py --manifest students.csv   # columns: student_id,name,class,path
+
+Images are decoded and embedded in parallel (one detector + recognizer per worker
+process) and all accepted students are written to faces_db in one batched commit.
+Rejected images/students are listed with a reason (DECODE_FAILED, NO_FACE, ...).
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import config_store as cfgs
+import cv_engine as eng
+import face_db as db
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+_detector = None
+_recognizer = None
+
+
+def _worker_init(score_thresh: float, long_side: int):
+    global _detector, _recognizer
+    _detector = eng.make_detector(score_thresh=score_thresh, long_side=long_side)
+    _recognizer = eng.make_recognizer()
+
+
+def _embed_image(task):
+    sid, path = task
+    # np.fromfile + imdecode also works for non-ASCII paths on Windows (cv2.imread does not)
+    try:
+        bgr = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    except OSError:
+        bgr = None
+    if bgr is None:
+        return sid, path, None, "DECODE_FAILED"
+    feat, _, code = eng.extract_feature(_detector, _recognizer, bgr)
+    return sid, path, feat, code
+
+
+def scan_dir(root: Path, cls: str):
+    """Yield (sid, name, class, path) for root/<sid>_<name>/<image>."""
+    for d in sorted(p for p in root.iterdir() if p.is_dir()):
+        sid, _, name = d.name.partition("_")
+        name = name.replace("_", " ").strip()
+        for p in sorted(d.iterdir()):
+            if p.suffix.lower() in IMAGE_EXTS:
+                yield sid.strip(), name, cls, str(p)
+
+
+def scan_manifest(path: Path, cls: str):
+    """Yield (sid, name, class, path) from a CSV with student_id,name[,class],path (paths relative to the CSV)."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for r in csv.DictReader(f):
+            img = Path(r["path"].strip())
+            if not img.is_absolute():
+                img = path.parent / img
+            yield r["student_id"].strip(), r.get("name", "").strip(), (r.get("class") or cls).strip(), str(img)
+
+
+def main():
+    cfg = cfgs.load_config()
+    ap = argparse.ArgumentParser(description="Enroll students from photo folders or a CSV manifest")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--dir", type=Path, help="folder with one <sid>_<name> sub-folder per student")
+    src.add_argument("--manifest", type=Path, help="CSV with student_id,name,class,path")
+    ap.add_argument("--class", dest="cls", default=cfg.get("default_class_name", "OS_Lab"),
+                    help="class for students without one in the manifest")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--min-samples", type=int, default=1, help="reject students with fewer usable images")
+    ap.add_argument("--score", type=float, default=float(cfg.get("default_face_score_threshold", 0.90)),
+                    help="face detector score threshold")
+    ap.add_argument("--detect-size", type=int, default=640,
+                    help="detect on a copy with this long side (0 = full resolution)")
+    ap.add_argument("--report", type=Path, help="write rejected images/students to this CSV")
+    ap.add_argument("--dry-run", action="store_true", help="embed and report, but do not write faces_db")
+    args = ap.parse_args()
+
+    tasks = scan_dir(args.dir, args.cls) if args.dir else scan_manifest(args.manifest, args.cls)
+    eng.ensure_models()  # download once here, not in every worker
+
+    t0 = time.perf_counter()
+    students = OrderedDict()  # sid -> [name, class, [feats]]
+    rejected = []
+    n_images = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=_worker_init,
+                             initargs=(args.score, args.detect_size)) as pool:
+        jobs = []
+        for sid, name, cls, path in tasks:
+            students.setdefault(sid, [name, cls, []])
+            jobs.append((sid, path))
+        for sid, path, feat, code in pool.map(_embed_image, jobs, chunksize=8):
+            n_images += 1
+            if code == "OK":
+                students[sid][2].append(feat)
+            else:
+                rejected.append((sid, path, code))
+
+    existing = db.load_meta()
+    records = []
+    for sid, (name, cls, feats) in students.items():
+        if not sid:
+            rejected.append((sid, "", "MISSING_ID"))
+        elif sid in existing:
+            rejected.append((sid, "", "ALREADY_ENROLLED"))
+        elif len(feats) < args.min_samples:
+            rejected.append((sid, "", f"TOO_FEW_SAMPLES ({len(feats)}<{args.min_samples})"))
+        else:
+            records.append((sid, name, cls, np.stack(feats)))
+
+    added = {} if args.dry_run else db.add_students(records)
+    dt = time.perf_counter() - t0
+
+    for sid, path, reason in rejected:
+        print(f"REJECTED  {sid:<16} {reason:<24} {path}")
+    print(f"{n_images} image(s), {len(students)} student(s) in {dt:.1f}s; "
+          f"{len(records)} accepted, {len(added)} written{' (dry run)' if args.dry_run else ''}, "
+          f"{len(rejected)} rejection(s)")
+
+    if args.report:
+        with open(args.report, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["student_id", "path", "reason"])
+            w.writerows(rejected)
+    return 0 if not rejected else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
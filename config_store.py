@@ -13,6 +13,27 @@ DEFAULTS = {
     "capture_interval_sec": 2.0,
     "enroll_samples_target": 10,
     "cooldown_hours": 24.0,
+    "attendance_backend": "csv",  # "csv" or "sqlite"
+    "detect_long_side": 0,  # run face detection on a downscaled copy (e.g. 320/640); 0 = full resolution
+    "detect_nms_attendance": 0.3,  # attendance: box overlap (IoU) above which the weaker face is dropped (max 0.3)
+    "detect_nms_enroll": 0.3,  # enrollment: same, for the enroll page
+    "detect_top_k_attendance": 0,  # attendance: keep at most this many best-scoring faces per frame (0 = all)
+    "detect_top_k_enroll": 0,  # enrollment: same, for the enroll page
+    "motion_sensitivity": 3.0,  # attendance: skip detection while the scene changes less than this (0 = off)
+    "motion_idle_detect_sec": 2.0,  # still detect at least this often when the scene is static
+    "target_latency_ms": 150.0,  # adaptive scheduler: camera-to-screen latency goal
+    "cpu_budget": 0.5,  # share of one CPU core the face detection/recognition may use (0.05-1.0)
+    "embed_workers": 0,  # worker processes for embedding several faces at once (0 = in the inference thread)
+    "batch_embed": True,  # embed several faces with one batched SFace forward pass (cv2.dnn)
+    "match_index": "exact",  # "exact" (brute force), "ivf" or "centroid" (approximate, for large galleries)
+    "ivf_nlist": 0,  # ivf: number of coarse clusters (0 = automatic)
+    "ivf_nprobe": 8,  # ivf: clusters scanned per face; higher = better recall, slower
+    "centroid_top_k": 8,  # centroid: candidate students re-ranked against all their samples
+    "centroid_medoids": 0,  # centroid: extra representative samples per student besides the mean
+    "match_verify": False,  # centroid: also run the exhaustive search and count disagreements
+    "embedding_dtype": "float32",  # resident gallery precision: float32, float16 or int8 (features.bin stays float32)
+    "perf_overlay": False,  # draw stage latencies / queue depth over the video (F3 toggles)
+    "metrics_interval_sec": 0.0,  # >0: write metrics/metrics.json and metrics.prom this often
 }
 
 def load_config():
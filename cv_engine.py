@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from pathlib import Path
-import urllib.request
+import multiprocessing
+import time
 import cv2
 import numpy as np
 
@@ -23,6 +24,7 @@ SFACE_URLS = [
 def _download(urls, dst: Path, min_bytes: int):
     if dst.exists() and dst.stat().st_size >= min_bytes:
         return
+    import urllib.request  # only needed the first time, when a model is missing
     last_err = None
     for u in urls:
         try:
@@ -40,25 +42,104 @@ def _download(urls, dst: Path, min_bytes: int):
                 pass
     raise RuntimeError(f"Failed to download {dst.name}. Last error: {last_err}")
 
+_models_ok = False
+
 def ensure_models():
+    """Download missing models; the files are only checked once per process."""
+    global _models_ok
+    if _models_ok:
+        return
     _download(YUNET_URLS, YUNET, min_bytes=200_000)
     _download(SFACE_URLS, SFACE, min_bytes=10_000_000)
+    _models_ok = True
+
+# The YuNet network is built once with these permissive settings; the score / NMS / top-k
+# each caller wants are applied to the returned face matrix (filter_faces), so changing
+# thresholds or switching between enrollment and attendance never rebuilds the network.
+# Score thresholds below DETECTOR_MIN_SCORE (the lowest the UI allows) build a lower one.
+DETECTOR_MIN_SCORE = 0.5
+DETECTOR_NMS = 0.3
+DETECTOR_TOP_K = 5000
+SCORE_COL = 14  # YuNet row: box (x, y, w, h), 5 landmarks (x, y), score
+
+class FaceDetector:
+    """
+    YuNet wrapper that only calls setInputSize when the frame size changes.
+    With long_side > 0, detection runs on a copy downscaled so its longer side is
+    long_side pixels; boxes and landmarks are mapped back to full-resolution
+    coordinates, so alignCrop still uses the original frame.
+    `score_thresh` is the default for detect_faces() calls that do not pass one;
+    `net_score` is the threshold the network was built with (nothing below it is returned).
+    """
+    def __init__(self, net, long_side: int = 0, score_thresh: float = 0.9, net_score: float = DETECTOR_MIN_SCORE):
+        self.net = net
+        self.score_thresh = float(score_thresh)
+        self.net_score = float(net_score)
+        self.long_side = int(long_side)
+        self.input_size = None
+        self._small = None
+
+    def _set_input_size(self, size):
+        if self.input_size != size:
+            self.net.setInputSize(size)
+            self.input_size = size
 
-def make_detector(score_thresh=0.9, nms_thresh=0.3, top_k=5000):
+    def detect(self, bgr: np.ndarray):
+        h, w = bgr.shape[:2]
+        if self.long_side <= 0 or max(w, h) <= self.long_side:
+            self._set_input_size((w, h))
+            return self.net.detect(bgr)[1]
+
+        scale = self.long_side / float(max(w, h))
+        sw, sh = max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+        if self._small is None or self._small.shape[:2] != (sh, sw):
+            self._small = np.empty((sh, sw, 3), dtype=np.uint8)
+        cv2.resize(bgr, (sw, sh), dst=self._small, interpolation=cv2.INTER_AREA)
+        self._set_input_size((sw, sh))
+        faces = self.net.detect(self._small)[1]
+        if faces is not None and len(faces):
+            # columns 0..13: box (x, y, w, h) + 5 landmarks; column 14 is the score
+            faces[:, :14] *= np.float32(w / float(sw))
+        return faces
+
+def make_detector(score_thresh=0.9, long_side=0):
+    """
+    score_thresh: default threshold of detect_faces() for this detector (the network itself
+    is built at min(score_thresh, DETECTOR_MIN_SCORE)).
+    long_side: run YuNet on a copy whose longer side is this many pixels (0 = full resolution).
+    """
     ensure_models()
-    detector = cv2.FaceDetectorYN.create(str(YUNET), "", (320, 320), float(score_thresh), float(nms_thresh), int(top_k))
-    return detector
+    net_score = min(float(score_thresh), DETECTOR_MIN_SCORE)
+    net = cv2.FaceDetectorYN.create(str(YUNET), "", (320, 320), net_score, DETECTOR_NMS, DETECTOR_TOP_K)
+    return FaceDetector(net, long_side=long_side, score_thresh=score_thresh, net_score=net_score)
 
 def make_recognizer():
     ensure_models()
     recognizer = cv2.FaceRecognizerSF.create(str(SFACE), "")
     return recognizer
 
-def detect_faces(detector, bgr: np.ndarray):
-    h, w = bgr.shape[:2]
-    detector.setInputSize((w, h))
-    faces = detector.detect(bgr)
-    return faces[1]
+def filter_faces(faces_mat, score_thresh: float, nms_thresh: float | None = None, top_k: int | None = None):
+    """
+    Faces scoring >= score_thresh, best score first. YuNet's own NMS (DETECTOR_NMS) is greedy by
+    score, so thresholding afterwards keeps exactly the faces a detector built with that
+    threshold would return; nms_thresh < DETECTOR_NMS suppresses more, top_k caps the count.
+    """
+    if faces_mat is None or len(faces_mat) == 0:
+        return np.empty((0, 15), dtype=np.float32)
+    faces_mat = faces_mat[faces_mat[:, SCORE_COL] >= float(score_thresh)]
+    faces_mat = faces_mat[np.argsort(-faces_mat[:, SCORE_COL], kind="stable")]
+    if nms_thresh is not None and float(nms_thresh) < DETECTOR_NMS and len(faces_mat) > 1:
+        keep = cv2.dnn.NMSBoxes(faces_mat[:, :4].tolist(), faces_mat[:, SCORE_COL].tolist(), 0.0, float(nms_thresh))
+        faces_mat = faces_mat[np.sort(np.asarray(keep, dtype=np.int64).reshape(-1))]
+    if top_k is not None:
+        faces_mat = faces_mat[:int(top_k)]
+    return faces_mat
+
+def detect_faces(detector, bgr: np.ndarray, score_thresh: float | None = None, nms_thresh: float | None = None,
+                 top_k: int | None = None):
+    """Face matrix (N x 15) filtered by filter_faces; score_thresh defaults to the detector's."""
+    score = detector.score_thresh if score_thresh is None else score_thresh
+    return filter_faces(detector.detect(bgr), score, nms_thresh, top_k)
 
 def pick_largest_face(faces_mat):
     if faces_mat is None or len(faces_mat) == 0:
@@ -67,15 +148,106 @@ def pick_largest_face(faces_mat):
     idx = int(np.argmax(areas))
     return faces_mat[idx]
 
+def select_faces(faces_mat, score_thresh: float, max_faces: int = 5):
+    """Faces above the score threshold (all faces if none passes), largest first, at most max_faces."""
+    if faces_mat is None or len(faces_mat) == 0:
+        return faces_mat[:0] if faces_mat is not None else np.empty((0, 15), dtype=np.float32)
+    keep = faces_mat[faces_mat[:, SCORE_COL] >= float(score_thresh)]
+    if len(keep) == 0:
+        keep = faces_mat
+    order = np.argsort(-(keep[:, 2] * keep[:, 3]), kind="stable")
+    return keep[order[:max_faces]]
+
+def crop_feature(recognizer, aligned: np.ndarray):
+    """SFace feature of one aligned 112x112 crop."""
+    return np.asarray(recognizer.feature(aligned), dtype=np.float32).reshape(-1)
+
+def embed_face(recognizer, bgr: np.ndarray, face_row):
+    return crop_feature(recognizer, recognizer.alignCrop(bgr, face_row))
+
+def align_faces(recognizer, bgr: np.ndarray, face_rows):
+    """112x112 aligned crops (input of recognizer.feature) for each face row."""
+    return [recognizer.alignCrop(bgr, row) for row in face_rows]
+
+# -------- Batched SFace forward pass (cv2.dnn on stacked crops) --------
+class BatchEmbedder:
+    """
+    Loads the SFace ONNX model with cv2.dnn.readNet and embeds N aligned crops with
+    one forward pass, using the same preprocessing as FaceRecognizerSF.feature
+    (blob of 112x112, scale 1, no mean, swapRB). If the network rejects batches
+    larger than one, it falls back to one forward per crop on the same net.
+    """
+    def __init__(self, model_path: Path = SFACE):
+        ensure_models()
+        self.net = cv2.dnn.readNet(str(model_path))
+        self.batch_ok = None
+
+    def _forward(self, blob):
+        self.net.setInput(blob)
+        return np.asarray(self.net.forward(), dtype=np.float32).reshape(blob.shape[0], -1)
+
+    def embed(self, crops) -> np.ndarray:
+        crops = list(crops)
+        if not crops:
+            return np.empty((0, 128), dtype=np.float32)
+        blob = cv2.dnn.blobFromImages(crops, 1.0, (112, 112), (0, 0, 0), swapRB=True, crop=False)
+        if len(crops) > 1 and self.batch_ok is not False:
+            try:
+                out = self._forward(blob)
+                self.batch_ok = True
+                return out
+            except cv2.error:
+                self.batch_ok = False
+        return np.concatenate([self._forward(blob[i:i + 1]) for i in range(len(crops))], axis=0)
+
+def verify_batch_embedder(embedder: BatchEmbedder, recognizer, crops, atol: float = 1e-4) -> bool:
+    """True if the batched features match recognizer.feature() crop by crop within `atol`."""
+    if not crops:
+        return True
+    batch = embedder.embed(crops)
+    ref = np.stack([np.asarray(recognizer.feature(c), dtype=np.float32).reshape(-1) for c in crops])
+    return bool(np.allclose(batch, ref, atol=atol, rtol=1e-4))
+
+# -------- Process-pool embedding (one FaceRecognizerSF per worker process) --------
+_pool_recognizer = None
+
+def _pool_init():
+    global _pool_recognizer
+    _pool_recognizer = cv2.FaceRecognizerSF.create(str(SFACE), "")
+
+def _pool_embed(aligned):
+    t0 = time.perf_counter()
+    feat = _pool_recognizer.feature(aligned)
+    return np.asarray(feat, dtype=np.float32).reshape(-1), time.perf_counter() - t0
+
+class EmbeddingPool:
+    """
+    Fans a batch of aligned crops out to `workers` processes. Each worker creates its
+    FaceRecognizerSF once (pool initializer); results come back in input order.
+    """
+    def __init__(self, workers: int):
+        ensure_models()
+        self.workers = int(workers)
+        self._pool = multiprocessing.get_context("spawn").Pool(self.workers, initializer=_pool_init)
+
+    def embed(self, crops):
+        """Returns (N x 128 float32 features, timing dict in ms)."""
+        t0 = time.perf_counter()
+        out = self._pool.map(_pool_embed, list(crops), chunksize=1)
+        total = time.perf_counter() - t0
+        feats = np.stack([f for f, _ in out]) if out else np.empty((0, 128), dtype=np.float32)
+        return feats, {"total_ms": 1000.0 * total, "worker_ms": [1000.0 * dt for _, dt in out]}
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+
 def extract_feature(detector, recognizer, bgr: np.ndarray):
     faces_mat = detect_faces(detector, bgr)
     face = pick_largest_face(faces_mat)
     if face is None:
         return None, None, "NO_FACE"
-    aligned = recognizer.alignCrop(bgr, face)
-    feat = recognizer.feature(aligned)
-    feat = np.asarray(feat, dtype=np.float32).reshape(-1)
-    return feat, face, "OK"
+    return embed_face(recognizer, bgr, face), face, "OK"
 
 def cosine_sim(recognizer, f1: np.ndarray, f2: np.ndarray) -> float:
     return float(recognizer.match(f1.reshape(1,-1), f2.reshape(1,-1), cv2.FaceRecognizerSF_FR_COSINE))
@@ -87,3 +259,120 @@ def draw_face_box(bgr, face_row, color=(0,255,0)):
     out = bgr.copy()
     cv2.rectangle(out, (x,y), (x+w, y+h), color, 2)
     return out
+
+def draw_face_boxes(bgr, face_rows, color=(0,255,0)):
+    """Draw all boxes directly into `bgr` (no copy)."""
+    for row in face_rows:
+        x, y, w, h = [int(v) for v in row[:4]]
+        cv2.rectangle(bgr, (x,y), (x+w, y+h), color, 2)
+    return bgr
+
+# -------- Face tracking (IoU association of YuNet boxes across frames) --------
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU between (n x 4) and (m x 4) boxes in (x, y, w, h) form."""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    ax2, ay2 = a[:, 0] + a[:, 2], a[:, 1] + a[:, 3]
+    bx2, by2 = b[:, 0] + b[:, 2], b[:, 1] + b[:, 3]
+    iw = np.clip(np.minimum(ax2[:, None], bx2[None, :]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    ih = np.clip(np.minimum(ay2[:, None], by2[None, :]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    inter = iw * ih
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None, :] - inter
+    return inter / np.maximum(union, 1e-6)
+
+class Track:
+    def __init__(self, track_id: int, face_row):
+        self.id = track_id
+        self.face = face_row
+        self.misses = 0
+        self.feat = None
+        self.sid = None
+        self.sim = -1.0
+        self.margin = 0.0
+        self.last_embed_t = 0.0
+
+class FaceTracker:
+    """
+    Greedy IoU association of detections to tracks. A track keeps the identity
+    of its last embedding, so a face that stays in view is not re-embedded every frame.
+    """
+    def __init__(self, iou_thresh: float = 0.3, max_misses: int = 10):
+        self.iou_thresh = float(iou_thresh)
+        self.max_misses = int(max_misses)
+        self.tracks = []
+        self._next_id = 1
+
+    def reset(self):
+        self.tracks = []
+
+    def update(self, faces) -> list:
+        """Returns one Track per row of `faces` (same order); unmatched tracks age out."""
+        faces = np.asarray(faces, dtype=np.float32).reshape(-1, 15) if len(faces) else np.empty((0, 15), np.float32)
+        assigned = [None] * len(faces)
+        used = set()
+        if self.tracks and len(faces):
+            iou = iou_matrix(np.stack([t.face[:4] for t in self.tracks]), faces[:, :4])
+            for flat in np.argsort(-iou, axis=None):
+                ti, fi = np.unravel_index(flat, iou.shape)
+                if iou[ti, fi] < self.iou_thresh:
+                    break
+                if ti in used or assigned[fi] is not None:
+                    continue
+                used.add(ti)
+                assigned[fi] = self.tracks[ti]
+        for i, t in enumerate(self.tracks):
+            if i not in used:
+                t.misses += 1
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+        for fi, face in enumerate(faces):
+            t = assigned[fi]
+            if t is None:
+                t = Track(self._next_id, face)
+                self._next_id += 1
+                self.tracks.append(t)
+                assigned[fi] = t
+            t.face = face
+            t.misses = 0
+        return assigned
+
+# -------- Motion gate (skip detection while the scene is static) --------
+class MotionGate:
+    """
+    Compares a tiny grayscale thumbnail of each frame with the one from the last
+    frame that went through detection. Detection is skipped while the mean absolute
+    difference stays below `sensitivity` (0-255 scale; 0 disables the gate), except
+    for one heartbeat detection every `idle_detect_sec` seconds.
+    """
+    def __init__(self, sensitivity: float = 3.0, idle_detect_sec: float = 2.0, thumb_size=(64, 36)):
+        self.sensitivity = float(sensitivity)
+        self.idle_detect_sec = float(idle_detect_sec)
+        self.thumb_size = tuple(thumb_size)
+        self._small = np.empty((self.thumb_size[1], self.thumb_size[0], 3), dtype=np.uint8)
+        self._ref = None
+        self._last_detect_t = 0.0
+        self.frames = 0
+        self.skipped = 0
+        self.last_score = 0.0
+
+    def reset(self):
+        self._ref = None
+        self._last_detect_t = 0.0
+
+    def should_detect(self, bgr: np.ndarray, now: float) -> bool:
+        self.frames += 1
+        if self.sensitivity <= 0:
+            return True
+        cv2.resize(bgr, self.thumb_size, dst=self._small, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(self._small, cv2.COLOR_BGR2GRAY)
+        if self._ref is not None:
+            self.last_score = float(cv2.mean(cv2.absdiff(gray, self._ref))[0])
+            static = self.last_score < self.sensitivity
+            if static and (self.idle_detect_sec <= 0 or now - self._last_detect_t < self.idle_detect_sec):
+                self.skipped += 1
+                return False
+        self._ref = gray
+        self._last_detect_t = now
+        return True
+
+    def snapshot(self):
+        return {"frames": self.frames, "skipped": self.skipped, "last_score": self.last_score}
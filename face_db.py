@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
+import csv
 import json
 from pathlib import Path
 from datetime import datetime, timedelta
 import numpy as np
-import pandas as pd
 import shutil
+import struct
+import threading
+import os
+import atexit
+
+import gallery_index
 
 ROOT = Path(__file__).resolve().parent
 DB_DIR = ROOT / "faces_db"
@@ -40,11 +46,20 @@ def _g2j(gy, gm, gd):
         jd = 1 + ((days - 186) % 30)
     return jy, jm, jd
 
-def jalali_today_str():
-    now = datetime.now()
-    jy, jm, jd = _g2j(now.year, now.month, now.day)
+_jalali_cache = (None, "")
+
+def jalali_date_str(day) -> str:
+    """Gregorian date (or datetime) -> Jalali "YYYY-MM-DD", as used in log file names."""
+    jy, jm, jd = _g2j(day.year, day.month, day.day)
     return f"{jy:04d}-{jm:02d}-{jd:02d}"
 
+def jalali_today_str():
+    global _jalali_cache
+    today = datetime.now().date()
+    if _jalali_cache[0] != today:
+        _jalali_cache = (today, jalali_date_str(today))
+    return _jalali_cache[1]
+
 def now_str():
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
@@ -53,90 +68,700 @@ def load_meta():
         return json.loads(META_PATH.read_text(encoding="utf-8"))
     return {}
 
+def atomic_write_text(path: Path, text: str):
+    """Write to a temp file next to `path`, fsync, then rename over it."""
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
 def save_meta(meta: dict):
-    META_PATH.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+    atomic_write_text(META_PATH, json.dumps(meta, ensure_ascii=False, indent=2))
+
+# -------- Consolidated feature store (faces_db/features.bin) --------
+# Layout: fixed 64-byte header, then contiguous records of (key int32, feat float32[128]).
+# students.json maps each student to its "key"; rows whose key is not referenced
+# there (deleted or re-enrolled students, unfinished writes) are ignored and
+# removed by compact_store(): deletes run it once orphans pass COMPACT_ORPHAN_FRACTION
+# of the file; `python -c "import face_db; face_db.compact_store()"` forces it.
+# Keys come from the header's next_key and are never reused. Only the first `rows`
+# records in the header are valid, so appends become visible in one step when the header is rewritten.
+STORE_PATH = DB_DIR / "features.bin"
+STORE_MAGIC = b"FADBSTOR"
+STORE_VERSION = 1
+FEAT_DIM = 128
+_HEADER = struct.Struct("<8sIIQQ")  # magic, version, dim, rows, next_key
+HEADER_SIZE = 64
+RECORD_DTYPE = np.dtype([("key", "<i4"), ("feat", "<f4", (FEAT_DIM,))])
+COMPACT_ORPHAN_FRACTION = 0.25  # deletes rewrite features.bin only past this share of orphaned rows
+
+def legacy_feat_path(student_id: str) -> Path:
+    """Old per-student layout: faces_db/<sid>/features.npy (read only by the migration)."""
+    return DB_DIR / str(student_id) / "features.npy"
+
+def _read_header(f):
+    f.seek(0)
+    raw = f.read(HEADER_SIZE)
+    if len(raw) < HEADER_SIZE:
+        raise ValueError("feature store header is truncated")
+    magic, version, dim, rows, next_key = _HEADER.unpack_from(raw)
+    if magic != STORE_MAGIC or version != STORE_VERSION or dim != FEAT_DIM:
+        raise ValueError(f"unsupported feature store: {STORE_PATH}")
+    return rows, next_key
+
+def _write_header(f, rows: int, next_key: int):
+    f.seek(0)
+    f.write(_HEADER.pack(STORE_MAGIC, STORE_VERSION, FEAT_DIM, int(rows), int(next_key)).ljust(HEADER_SIZE, b"\0"))
+
+def _create_store(path: Path, rows: int = 0, next_key: int = 0):
+    with open(path, "wb") as f:
+        _write_header(f, rows, next_key)
+
+def load_store() -> np.ndarray:
+    """All committed records as a read-only memmap (one open, one map)."""
+    if not STORE_PATH.exists():
+        return np.empty((0,), dtype=RECORD_DTYPE)
+    with open(STORE_PATH, "rb") as f:
+        rows, _ = _read_header(f)
+    if rows == 0:
+        return np.empty((0,), dtype=RECORD_DTYPE)
+    return np.memmap(STORE_PATH, dtype=RECORD_DTYPE, mode="r", offset=HEADER_SIZE, shape=(rows,))
 
-def student_dir(student_id: str) -> Path:
-    d = DB_DIR / str(student_id)
-    d.mkdir(exist_ok=True)
-    return d
+def _store_append_many(blocks) -> list:
+    """
+    Append several (key, feats) blocks (key None = allocate a new key) with one write
+    and a single header update; returns the keys in order.
+    """
+    if not STORE_PATH.exists():
+        _create_store(STORE_PATH)
+    with open(STORE_PATH, "r+b") as f:
+        rows, next_key = _read_header(f)
+        keys, parts = [], []
+        for key, feats in blocks:
+            feats = np.asarray(feats, dtype=np.float32).reshape(-1, FEAT_DIM)
+            if key is None:
+                key = next_key
+            next_key = max(next_key, int(key) + 1)
+            recs = np.empty((feats.shape[0],), dtype=RECORD_DTYPE)
+            recs["key"] = int(key)
+            recs["feat"] = feats
+            keys.append(int(key))
+            parts.append(recs)
+        recs = np.concatenate(parts) if parts else np.empty((0,), dtype=RECORD_DTYPE)
+        f.seek(HEADER_SIZE + rows * RECORD_DTYPE.itemsize)
+        f.write(recs.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+        _write_header(f, rows + recs.shape[0], next_key)
+        f.flush()
+        os.fsync(f.fileno())
+    return keys
 
-def feat_path(student_id: str) -> Path:
-    return student_dir(student_id) / "features.npy"
+def _store_append(key, feats: np.ndarray) -> int:
+    """Append rows for `key` (None = allocate a new key); returns the key."""
+    return _store_append_many([(key, feats)])[0]
+
+def _student_key(meta: dict, student_id: str):
+    info = meta.get(str(student_id))
+    if not info or "key" not in info:
+        return None
+    return int(info["key"])
 
 def load_features(student_id: str) -> np.ndarray:
-    p = feat_path(student_id)
-    if p.exists():
-        return np.load(p)
-    return np.empty((0, 128), dtype=np.float32)
+    key = _student_key(load_meta(), student_id)
+    recs = load_store()
+    if key is None or recs.shape[0] == 0:
+        return np.empty((0, FEAT_DIM), dtype=np.float32)
+    return np.array(recs["feat"][recs["key"] == key], dtype=np.float32)
 
 def append_feature(student_id: str, feat: np.ndarray):
-    feat = feat.astype(np.float32).reshape(1, -1)
-    cur = load_features(student_id)
-    new = np.concatenate([cur, feat], axis=0) if cur.size else feat
-    np.save(feat_path(student_id), new)
+    """Add samples to an enrolled student (KeyError otherwise; new students go through add_student)."""
+    key = _student_key(load_meta(), student_id)
+    if key is None:
+        raise KeyError(f"student not enrolled: {student_id}")
+    _store_append(key, feat)
+
+def add_student(student_id: str, name: str, cls: str, feats: np.ndarray):
+    """
+    Enroll a student with all samples at once: one store append, then students.json is
+    replaced atomically. That rename is the commit point - if we crash before it, the
+    appended rows have no owner and are dropped by compact_store().
+    Returns the student's meta entry, or None if the ID is already enrolled.
+    """
+    sid = str(student_id)
+    meta = load_meta()
+    if sid in meta:
+        return None
+    key = _store_append(None, feats)
+    meta[sid] = {"name": name, "class": cls, "key": key}
+    save_meta(meta)
+    return meta[sid]
+
+def add_students(records):
+    """
+    Batched add_student for many students: records are (sid, name, cls, feats).
+    All rows go to the store in one write and students.json is committed once.
+    IDs that are already enrolled (or repeated) are skipped; returns {sid: meta entry} of added students.
+    """
+    meta = load_meta()
+    todo, seen = [], set(meta.keys())
+    for sid, name, cls, feats in records:
+        sid = str(sid)
+        if sid in seen:
+            continue
+        seen.add(sid)
+        todo.append((sid, name, cls, feats))
+    if not todo:
+        return {}
+    keys = _store_append_many([(None, feats) for _, _, _, feats in todo])
+    added = {}
+    for (sid, name, cls, _), key in zip(todo, keys):
+        meta[sid] = added[sid] = {"name": name, "class": cls, "key": key}
+    save_meta(meta)
+    return added
+
+def migrate_legacy_store():
+    """
+    Import faces_db/<sid>/features.npy for every student that has no store key yet.
+    Legacy files are left on disk; returns the number of migrated students.
+    """
+    meta = load_meta()
+    migrated = 0
+    for sid, info in meta.items():
+        if "key" in info:
+            continue
+        p = legacy_feat_path(sid)
+        if not p.exists():
+            continue
+        feats = np.load(p)
+        if feats.shape[0] == 0:
+            continue
+        info["key"] = _store_append(None, feats)
+        migrated += 1
+    if migrated:
+        save_meta(meta)
+    return migrated
+
+def compact_store(min_orphan_fraction: float = 0.0):
+    """
+    Rewrite features.bin without orphaned rows (temp file + rename). With
+    min_orphan_fraction > 0 the file is left alone (only its keys are scanned)
+    unless at least that share of its rows is orphaned. Returns rows removed.
+    """
+    recs = load_store()
+    if recs.shape[0] == 0:
+        return 0
+    live = {int(info["key"]) for info in load_meta().values() if "key" in info}
+    keep = np.isin(recs["key"], np.fromiter(live, dtype=np.int32, count=len(live)))
+    removed = int(recs.shape[0] - np.count_nonzero(keep))
+    if removed == 0 or removed < min_orphan_fraction * recs.shape[0]:
+        return 0
+    with open(STORE_PATH, "rb") as f:
+        _, next_key = _read_header(f)
+    kept = np.array(recs[keep])
+    del recs
+    tmp = STORE_PATH.with_suffix(".bin.tmp")
+    with open(tmp, "wb") as f:
+        _write_header(f, kept.shape[0], next_key)
+        f.write(kept.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, STORE_PATH)
+    return removed
+
+# -------- In-memory gallery (all enrolled samples, L2-normalized) --------
+def l2_normalize(feats: np.ndarray) -> np.ndarray:
+    feats = np.asarray(feats, dtype=np.float32).reshape(-1, 128)
+    norms = np.linalg.norm(feats, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return feats / norms
+
+class Gallery:
+    """
+    Resident copy of faces_db used for matching.
+    Rows of `mat` are grouped per student: student i owns rows starts[i]:starts[i+1].
+    Build once with Gallery.load(), then keep in sync with add()/remove().
+    Matching may run on another thread; the index arrays are swapped under a lock.
+    Searching is delegated to a gallery_index backend ("exact", "ivf" or "centroid"),
+    rebuilt on every change; an index that needs training (ivf) is trained on a
+    background thread and swapped in when ready. `dtype` sets the resident precision (float32, float16 or
+    int8); features.bin always keeps the float32 originals.
+    """
+    def __init__(self, index: str = "exact", dtype: str = "float32", **index_params):
+        self._lock = threading.Lock()
+        self.index_kind = index
+        self.index_params = index_params
+        self.dtype = dtype
+        self.index = None
+        self._trainer = None
+        self.meta = {}
+        self.sids = []
+        self.sid_index = {}  # sid -> position in sids
+        self.mat = gallery_index.EmbeddingMatrix(np.empty((0, FEAT_DIM), dtype=np.float32), dtype)
+        self.row_sid = np.empty((0,), dtype=np.int32)
+        self.starts = np.empty((0,), dtype=np.int64)
+
+    @classmethod
+    def load(cls, index: str = "exact", dtype: str = "float32", **index_params):
+        g = cls(index=index, dtype=dtype, **index_params)
+        g.reload()
+        return g
+
+    @classmethod
+    def from_blocks(cls, blocks: dict, index: str = "exact", dtype: str = "float32", **index_params):
+        """Gallery over {sid: samples} held only in memory (benchmarks; nothing is read from faces_db)."""
+        g = cls(index=index, dtype=dtype, **index_params)
+        g._rebuild({sid: l2_normalize(feats) for sid, feats in blocks.items()})
+        return g
+
+    @classmethod
+    def from_config(cls, cfg: dict):
+        """Gallery with the match_index / embedding_dtype settings of config.json."""
+        index = cfg.get("match_index", "exact")
+        params = {}
+        if index == "ivf":
+            params = {"nlist": int(cfg.get("ivf_nlist", 0)), "nprobe": int(cfg.get("ivf_nprobe", 8))}
+        elif index == "centroid":
+            params = {"top_k": int(cfg.get("centroid_top_k", 8)), "medoids": int(cfg.get("centroid_medoids", 0)),
+                      "verify": bool(cfg.get("match_verify", False))}
+        return cls.load(index=index, dtype=cfg.get("embedding_dtype", "float32"), **params)
+
+    def reload(self):
+        migrate_legacy_store()
+        self.meta = load_meta()
+        key_to_sid = {int(info["key"]): sid for sid, info in self.meta.items() if "key" in info}
+        recs = load_store()
+        keys = np.asarray(recs["key"])
+        live = np.isin(keys, np.fromiter(key_to_sid.keys(), dtype=np.int32, count=len(key_to_sid)))
+        idx = np.flatnonzero(live)
+        idx = idx[np.argsort(keys[idx], kind="stable")]
+        mat = l2_normalize(recs["feat"][idx]) if idx.size else np.empty((0, 128), dtype=np.float32)
+        uniq, starts, counts = np.unique(keys[idx], return_index=True, return_counts=True)
+        blocks = {key_to_sid[int(k)]: mat[s:s + n] for k, s, n in zip(uniq, starts, counts)}
+        self._rebuild(blocks)
+
+    def blocks(self):
+        """{sid: its L2-normalized samples (k x 128 float32)}, in gallery order."""
+        ends = list(self.starts[1:]) + [self.mat.shape[0]]
+        full = self.mat.take()
+        return {sid: full[s:e] for sid, s, e in zip(self.sids, self.starts, ends)}
+
+    def _origins(self):
+        """{sid: its rows in the current matrix}, passed to the next index as the row origin."""
+        ends = list(self.starts[1:]) + [self.mat.shape[0]]
+        return {sid: np.arange(s, e, dtype=np.int64) for sid, s, e in zip(self.sids, self.starts, ends)}
+
+    def _rebuild(self, blocks: dict, origins: dict | None = None):
+        sids = list(blocks.keys())
+        origin = None
+        if not sids:
+            mat = np.empty((0, 128), dtype=np.float32)
+            row_sid = np.empty((0,), dtype=np.int32)
+            starts = np.empty((0,), dtype=np.int64)
+        else:
+            counts = np.array([blocks[s].shape[0] for s in sids], dtype=np.int64)
+            mat = np.ascontiguousarray(np.concatenate([blocks[s] for s in sids], axis=0), dtype=np.float32)
+            row_sid = np.repeat(np.arange(len(sids), dtype=np.int32), counts)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+            if origins is not None:
+                origin = np.concatenate([origins[s] for s in sids])
+        mat = gallery_index.EmbeddingMatrix(mat, self.dtype)
+        index = gallery_index.build_index(self.index_kind, mat, row_sid, starts, len(sids),
+                                          prev=self.index, origin=origin, **self.index_params)
+        sid_index = {sid: i for i, sid in enumerate(sids)}
+        with self._lock:
+            self.sids, self.mat, self.row_sid, self.starts, self.index = sids, mat, row_sid, starts, index
+            self.sid_index = sid_index
+        if getattr(index, "needs_training", False):
+            self._start_training()
+
+    def _start_training(self):
+        with self._lock:
+            if self._trainer is not None:
+                return
+            self._trainer = threading.Thread(target=self._train_index, name="index-train", daemon=True)
+            self._trainer.start()
+
+    def _train_index(self):
+        """Train the current index and swap it in; again if the gallery changed meanwhile."""
+        while True:
+            with self._lock:
+                index = self.index
+                if not getattr(index, "needs_training", False):
+                    self._trainer = None
+                    return
+            try:
+                trained = index.train()
+            except Exception:
+                with self._lock:
+                    self._trainer = None  # the next change retries
+                return
+            with self._lock:
+                if self.index is index:
+                    self.index = trained
+
+    def wait_for_index(self, timeout: float | None = None):
+        """Block until background index training (if any) is done."""
+        t = self._trainer
+        if t is not None:
+            t.join(timeout)
+
+    def add(self, student_id: str, feats: np.ndarray, info: dict | None = None):
+        sid = str(student_id)
+        if info is not None:
+            self.meta[sid] = info
+        blocks, origins = self.blocks(), self._origins()
+        new = l2_normalize(feats)
+        origin = np.full(new.shape[0], -1, dtype=np.int64)  # rows the index has not seen yet
+        if sid in blocks:
+            new = np.concatenate([blocks[sid], new], axis=0)
+            origin = np.concatenate([origins[sid], origin])
+        blocks[sid], origins[sid] = new, origin
+        self._rebuild(blocks, origins)
+
+    def remove(self, student_id: str):
+        self.remove_many([student_id])
+
+    def remove_many(self, student_ids):
+        sids = {str(s) for s in student_ids}
+        for sid in sids:
+            self.meta.pop(sid, None)
+        if sids & set(self.sids):
+            blocks, origins = self.blocks(), self._origins()
+            for sid in sids:
+                blocks.pop(sid, None)
+                origins.pop(sid, None)
+            self._rebuild(blocks, origins)
+
+    def __len__(self):
+        return len(self.sids)
+
+    def sample_count(self, student_id: str) -> int:
+        with self._lock:
+            i = self.sid_index.get(str(student_id))
+            starts, n_rows = self.starts, self.mat.shape[0]
+        if i is None:
+            return 0
+        end = starts[i + 1] if i + 1 < len(starts) else n_rows
+        return int(end - starts[i])
+
+    def match(self, feat: np.ndarray, threshold: float):
+        """Return (student_id or None, best similarity) for one probe feature."""
+        sid, sim, _ = self.match_batch(feat, threshold)[0]
+        return sid, sim
+
+    def match_batch(self, feats: np.ndarray, threshold: float):
+        """
+        Match a (k x 128) block of probe features with one matrix product.
+        Returns k tuples (student_id or None, best similarity, margin to the runner-up student).
+        """
+        q = l2_normalize(feats)
+        k = q.shape[0]
+        with self._lock:
+            sids, index = self.sids, self.index
+        if not sids or k == 0 or index is None:
+            return [(None, -1.0, 0.0) for _ in range(k)]
+        idx, sims = index.search(q)
+        out = []
+        for i, s, s2 in zip(idx[:, 0], sims[:, 0], sims[:, 1]):
+            if i < 0:
+                out.append((None, -1.0, 0.0))
+                continue
+            sid = sids[int(i)] if s >= threshold else None
+            out.append((sid, float(s), float(s - s2)))
+        return out
+
+def safe_class_name(class_name: str) -> str:
+    return "".join([c if c.isalnum() or c in "_-" else "_" for c in class_name])
 
 def attendance_csv_path(class_name: str) -> Path:
-    safe = "".join([c if c.isalnum() or c in "_-" else "_" for c in class_name])
+    safe = safe_class_name(class_name)
     j = jalali_today_str()
     return LOG_DIR / f"{safe}_{j}.csv"
 
+ATTENDANCE_COLUMNS = ["timestamp", "jalali_date", "class", "student_id", "name", "cosine_similarity"]
+
+class AttendanceWriter:
+    """
+    Appends attendance rows to today's per-class CSV with the csv module.
+    The current file stays open; rows are flushed after `batch_size` rows or
+    `flush_interval` seconds, and fsync'ed on class/day rollover and close().
+    """
+    def __init__(self, flush_interval: float = 1.0, batch_size: int = 16):
+        self.flush_interval = float(flush_interval)
+        self.batch_size = int(batch_size)
+        self._lock = threading.RLock()
+        self._path = None
+        self._f = None
+        self._w = None
+        self._pending = {}  # sid -> timestamp of rows written but not flushed yet
+        self._pending_rows = 0
+        self._timer = None
+
+    def write(self, class_name: str, sid: str, name: str, similarity: float) -> Path:
+        ts = now_str()
+        p = attendance_csv_path(class_name)
+        with self._lock:
+            if p != self._path:
+                self._close_locked()
+                self._open_locked(p)
+            self._w.writerow([ts, jalali_today_str(), class_name, str(sid), name, float(similarity)])
+            self._pending[str(sid)] = ts
+            self._pending_rows += 1
+            if self._pending_rows >= self.batch_size:
+                self._flush_locked()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return p
+
+    def _open_locked(self, p: Path):
+        is_new = not p.exists() or p.stat().st_size == 0
+        self._f = open(p, "a", newline="", encoding="utf-8")
+        self._w = csv.writer(self._f, lineterminator=os.linesep)  # same line endings as pandas.to_csv
+        if is_new:
+            self._w.writerow(ATTENDANCE_COLUMNS)
+        self._path = p
+
+    def _flush_locked(self, fsync: bool = False):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._f is None:
+            return
+        self._f.flush()
+        if fsync:
+            os.fsync(self._f.fileno())
+        pending, self._pending = self._pending, {}
+        self._pending_rows = 0
+        if pending:
+            update_last_seen(pending)
+
+    def _close_locked(self):
+        if self._f is None:
+            return
+        self._flush_locked(fsync=True)
+        self._f.close()
+        self._f = None
+        self._w = None
+        self._path = None
+
+    def flush(self, fsync: bool = False):
+        with self._lock:
+            self._flush_locked(fsync=fsync)
+
+    def close(self):
+        """Flush, fsync and close the current file (it is reopened on the next write)."""
+        with self._lock:
+            self._close_locked()
+
+_writer = AttendanceWriter()
+
+# "csv" (default, attendance_logs/<class>_<jalali>.csv) or "sqlite" (see attendance_db.py)
+ATTENDANCE_BACKEND = "csv"
+_sqlite_store = None
+
+def set_attendance_backend(name: str):
+    global ATTENDANCE_BACKEND
+    name = str(name or "csv").lower()
+    if name not in ("csv", "sqlite"):
+        raise ValueError(f"Unknown attendance backend: {name}")
+    if name != ATTENDANCE_BACKEND:
+        close_attendance()
+    ATTENDANCE_BACKEND = name
+
+def _sqlite():
+    global _sqlite_store
+    if _sqlite_store is None:
+        import attendance_db
+        _sqlite_store = attendance_db.SQLiteAttendanceStore(LOG_DIR / attendance_db.DB_PATH.name)
+    return _sqlite_store
+
 def append_attendance_row(class_name: str, sid: str, name: str, similarity: float):
-    p = attendance_csv_path(class_name)
-    row = pd.DataFrame([{
-        "timestamp": now_str(),
-        "jalali_date": jalali_today_str(),
-        "class": class_name,
-        "student_id": str(sid),
-        "name": name,
-        "cosine_similarity": float(similarity),
-    }])
-    if p.exists():
-        row.to_csv(p, mode="a", header=False, index=False)
-    else:
-        row.to_csv(p, index=False)
-    return p
+    if ATTENDANCE_BACKEND == "sqlite":
+        store = _sqlite()
+        store.append(now_str(), jalali_today_str(), class_name, sid, name, similarity)
+        return store.path
+    return _writer.write(class_name, sid, name, similarity)
 
-def delete_student(student_id: str, delete_logs: bool = True):
-    sid = str(student_id)
+def flush_attendance(fsync: bool = False):
+    _writer.flush(fsync=fsync)
+
+def close_attendance():
+    global _sqlite_store
+    _writer.close()
+    if _sqlite_store is not None:
+        _sqlite_store.close()
+        _sqlite_store = None
+
+atexit.register(close_attendance)
+
+def _filter_log_file(p: Path, sids: set) -> bool:
+    """Drop rows of `sids` from one CSV; rewrites it (temp file + rename) only if something matched."""
+    with open(p, newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    if not rows or "student_id" not in rows[0]:
+        return False
+    col = rows[0].index("student_id")
+    kept = [r for r in rows[1:] if len(r) <= col or r[col] not in sids]
+    if len(kept) == len(rows) - 1:
+        return False
+    if not kept:
+        p.unlink(missing_ok=True)
+        return True
+    tmp = p.with_name(p.name + ".tmp")
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f, lineterminator=os.linesep)
+        w.writerow(rows[0])
+        w.writerows(kept)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, p)
+    return True
+
+def delete_students(student_ids, delete_logs: bool = True):
+    """
+    Delete many students at once: one students.json write and a single pass over
+    the attendance logs (each file rewritten at most once). Their feature rows are
+    left as orphans until they reach COMPACT_ORPHAN_FRACTION of features.bin.
+    Returns the number of log files changed.
+    """
+    sids = {str(s) for s in student_ids}
+    if not sids:
+        return 0
     meta = load_meta()
-    if sid in meta:
-        del meta[sid]
+    if sids & meta.keys():
+        for sid in sids:
+            meta.pop(sid, None)
         save_meta(meta)
+    compact_store(COMPACT_ORPHAN_FRACTION)
 
-    d = DB_DIR / sid
-    if d.exists():
-        shutil.rmtree(d, ignore_errors=True)
+    for sid in sids:
+        d = DB_DIR / sid
+        if d.exists():
+            shutil.rmtree(d, ignore_errors=True)
 
-    if delete_logs:
+    changed = 0
+    if delete_logs and ATTENDANCE_BACKEND == "sqlite":
+        changed = _sqlite().delete_students(sids)
+    elif delete_logs:
+        close_attendance()
         for p in LOG_DIR.glob("*.csv"):
             try:
-                df = pd.read_csv(p)
-                if "student_id" in df.columns:
-                    df2 = df[df["student_id"].astype(str) != sid]
-                    if len(df2) == 0:
-                        p.unlink(missing_ok=True)
-                    else:
-                        df2.to_csv(p, index=False)
+                changed += _filter_log_file(p, sids)
             except Exception:
                 pass
+        # keep the index newer than the rewritten logs so it is not considered stale
+        last = load_last_seen()
+        for sid in sids:
+            last.pop(sid, None)
+        save_last_seen(last)
+    return changed
+
+def delete_student(student_id: str, delete_logs: bool = True):
+    delete_students([student_id], delete_logs=delete_logs)
+
+# -------- Last-seen index (attendance_logs/last_seen.json) --------
+# {student_id: "YYYY-mm-dd HH:MM:SS"} of the newest attendance row per student.
+# Updated on every append; rebuilt from the CSVs only when missing or older than a log file.
+LAST_SEEN_PATH = LOG_DIR / "last_seen.json"
+_last_seen_cache = None
+
+def save_last_seen(last: dict):
+    global _last_seen_cache
+    _last_seen_cache = dict(last)
+    atomic_write_text(LAST_SEEN_PATH, json.dumps(_last_seen_cache, ensure_ascii=False))
+
+def update_last_seen(rows: dict):
+    """Merge {sid: timestamp_str} into the index (newer timestamps win)."""
+    last = load_last_seen()
+    for sid, ts in rows.items():
+        if ts > last.get(sid, ""):
+            last[sid] = ts
+    save_last_seen(last)
+
+def _last_seen_stale() -> bool:
+    if not LAST_SEEN_PATH.exists():
+        return True
+    idx_mtime = LAST_SEEN_PATH.stat().st_mtime
+    with os.scandir(LOG_DIR) as it:
+        for e in it:
+            if e.name.endswith(".csv") and e.stat().st_mtime > idx_mtime:
+                return True
+    return False
+
+def rebuild_last_seen() -> dict:
+    """Scan every CSV once and take a vectorized groupby-max per student."""
+    import pandas as pd  # heavy import, only needed for this (rare) full rebuild
+    flush_attendance()
+    frames = []
+    for p in LOG_DIR.glob("*.csv"):
+        try:
+            df = pd.read_csv(p, usecols=["student_id", "timestamp"], dtype=str)
+            frames.append(df)
+        except Exception:
+            continue
+    last = {}
+    if frames:
+        df = pd.concat(frames, ignore_index=True)
+        df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
+        df = df.dropna(subset=["timestamp", "student_id"])
+        if len(df):
+            latest = df.groupby("student_id")["timestamp"].max()
+            last = {str(sid): t.strftime("%Y-%m-%d %H:%M:%S") for sid, t in latest.items()}
+    save_last_seen(last)
+    return last
+
+def drop_last_seen():
+    """Forget the index (file and cache); the next load rebuilds it from the logs."""
+    global _last_seen_cache
+    LAST_SEEN_PATH.unlink(missing_ok=True)
+    _last_seen_cache = None
+
+def load_last_seen() -> dict:
+    global _last_seen_cache
+    if _last_seen_cache is not None:
+        return dict(_last_seen_cache)
+    if _last_seen_stale():
+        return rebuild_last_seen()
+    try:
+        _last_seen_cache = json.loads(LAST_SEEN_PATH.read_text(encoding="utf-8"))
+    except Exception:
+        return rebuild_last_seen()
+    return dict(_last_seen_cache)
 
 def build_last_records(hours: float = 12.0):
     cutoff = datetime.now() - timedelta(hours=float(hours))
     last = {}
-    for p in LOG_DIR.glob("*.csv"):
+    seen = _sqlite().last_seen() if ATTENDANCE_BACKEND == "sqlite" else load_last_seen()
+    for sid, ts in seen.items():
         try:
-            df = pd.read_csv(p)
-            if not {"student_id","timestamp"}.issubset(set(df.columns)):
-                continue
-            df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
-            df = df.dropna(subset=["timestamp"])
-            df = df[df["timestamp"] >= cutoff]
-            for _, r in df.iterrows():
-                sid = str(r["student_id"])
-                t = r["timestamp"].to_pydatetime()
-                if sid not in last or t > last[sid]:
-                    last[sid] = t
-        except Exception:
+            t = datetime.strptime(ts, "%Y-%m-%d %H:%M:%S")
+        except ValueError:
             continue
+        if t >= cutoff:
+            last[sid] = t
     return last
+
+
+# -------- Data locations --------
+def set_data_dirs(db_dir=None, log_dir=None):
+    """
+    Point faces_db / attendance_logs somewhere else (benchmarks, replays, tests).
+    Pending attendance rows are flushed to the old location first.
+    """
+    global DB_DIR, LOG_DIR, META_PATH, STORE_PATH, LAST_SEEN_PATH, _last_seen_cache
+    close_attendance()
+    if db_dir is not None:
+        DB_DIR = Path(db_dir)
+        DB_DIR.mkdir(parents=True, exist_ok=True)
+        META_PATH = DB_DIR / "students.json"
+        STORE_PATH = DB_DIR / "features.bin"
+    if log_dir is not None:
+        LOG_DIR = Path(log_dir)
+        LOG_DIR.mkdir(parents=True, exist_ok=True)
+        LAST_SEEN_PATH = LOG_DIR / "last_seen.json"
+        _last_seen_cache = None
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Search backends used by face_db.Gallery.
+
+Every backend is built from the gallery arrays (L2-normalized rows grouped per
+student, held in an EmbeddingMatrix) and answers search(q) -> (student indices, similarities), both k x 2:
+best and runner-up student per probe (-1 / -1.0 when there is no runner-up).
+
+  exact    : brute force, one GEMM + per-student max
+  ivf      : inverted file over spherical k-means centroids (pure NumPy);
+             only the `nprobe` closest lists are scanned; k-means runs off the
+             UI thread (Gallery trains it in the background)
+  centroid : per-student mean embedding (+ optional medoids) as a first pass,
+             then an exact per-sample re-rank of the `top_k` best students
+"""
+import numpy as np
+
+INDEX_KINDS = ("exact", "ivf", "centroid")
+EMBED_DTYPES = ("float32", "float16", "int8")
+
+
+class EmbeddingMatrix:
+    """
+    Resident gallery rows stored as float32, float16 or int8 (one float32 scale per row).
+    Similarities are computed in float32 over chunks of rows, so at most one chunk is
+    upcast at a time; the full float32 matrix is never kept for the quantized types.
+    """
+    CHUNK = 16384
+
+    def __init__(self, mat: np.ndarray, dtype: str = "float32"):
+        dtype = (dtype or "float32").lower()
+        if dtype not in EMBED_DTYPES:
+            raise ValueError(f"Unknown embedding dtype: {dtype}")
+        self.dtype = dtype
+        mat = np.asarray(mat, dtype=np.float32)
+        self.scale = None
+        if dtype == "float32":
+            self.data = np.ascontiguousarray(mat)
+        elif dtype == "float16":
+            self.data = mat.astype(np.float16)
+        else:
+            scale = np.abs(mat).max(axis=1) / 127.0 if mat.shape[0] else np.empty((0,), dtype=np.float32)
+            scale[scale == 0] = 1.0
+            self.data = np.round(mat / scale[:, None]).astype(np.int8)
+            self.scale = scale.astype(np.float32)
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.data.nbytes + (self.scale.nbytes if self.scale is not None else 0))
+
+    def take(self, rows=None) -> np.ndarray:
+        """Selected rows (index array, or all rows) as float32."""
+        data = self.data if rows is None else self.data[rows]
+        if self.dtype == "float32":
+            return data
+        x = data.astype(np.float32)
+        if self.scale is not None:
+            x *= (self.scale if rows is None else self.scale[rows])[:, None]
+        return x
+
+    def dot(self, q: np.ndarray, rows=None) -> np.ndarray:
+        """q (k x d) against the selected rows -> (k x n) float32 similarities."""
+        q = np.asarray(q, dtype=np.float32)
+        if self.dtype == "float32":
+            return q @ self.take(rows).T
+        n = self.data.shape[0] if rows is None else len(rows)
+        out = np.empty((q.shape[0], n), dtype=np.float32)
+        for s in range(0, n, self.CHUNK):
+            sel = np.arange(s, min(s + self.CHUNK, n)) if rows is None else rows[s:s + self.CHUNK]
+            out[:, s:s + self.CHUNK] = q @ self.take(sel).T
+        return out
+
+
+def _top2_per_student(sims: np.ndarray, student: np.ndarray):
+    """Best two distinct students among candidate rows of ONE probe."""
+    out_i = np.full(2, -1, dtype=np.int64)
+    out_s = np.full(2, -1.0, dtype=np.float32)
+    if sims.size == 0:
+        return out_i, out_s
+    order = np.lexsort((-sims, student))  # by student, best row first
+    first = np.ones(order.size, dtype=bool)
+    first[1:] = student[order[1:]] != student[order[:-1]]
+    best_rows = order[first]
+    top = best_rows[np.argsort(-sims[best_rows], kind="stable")[:2]]
+    out_i[:top.size] = student[top]
+    out_s[:top.size] = sims[top]
+    return out_i, out_s
+
+
+class ExactIndex:
+    kind = "exact"
+
+    def __init__(self, mat: np.ndarray, row_sid: np.ndarray, starts: np.ndarray, n_students: int):
+        self.mat = mat
+        self.starts = starts
+        self.n_students = int(n_students)
+
+    def search(self, q: np.ndarray):
+        k = q.shape[0]
+        if self.n_students == 0 or k == 0:
+            return np.full((k, 2), -1, dtype=np.int64), np.full((k, 2), -1.0, dtype=np.float32)
+        per_student = np.maximum.reduceat(self.mat.dot(q), self.starts, axis=1)
+        if self.n_students == 1:
+            idx = np.zeros((k, 1), dtype=np.int64)
+        else:
+            idx = np.argpartition(per_student, -2, axis=1)[:, -2:]
+        sims = np.take_along_axis(per_student, idx, axis=1)
+        order = np.argsort(-sims, axis=1)
+        idx = np.take_along_axis(idx, order, axis=1)
+        sims = np.take_along_axis(sims, order, axis=1)
+        if idx.shape[1] == 1:
+            idx = np.hstack([idx, np.full((k, 1), -1, dtype=np.int64)])
+            sims = np.hstack([sims, np.full((k, 1), -1.0, dtype=sims.dtype)])
+        return idx, sims
+
+
+def spherical_kmeans(x: np.ndarray, n_clusters: int, iters: int = 10, seed: int = 0) -> np.ndarray:
+    """Unit-norm centroids maximizing cosine similarity (x rows must be L2-normalized)."""
+    rng = np.random.default_rng(seed)
+    n_clusters = max(1, min(int(n_clusters), x.shape[0]))
+    cent = x[rng.choice(x.shape[0], n_clusters, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(x @ cent.T, axis=1)
+        sums = np.zeros_like(cent)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=n_clusters)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = x[rng.choice(x.shape[0], int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        cent = (sums / norms).astype(np.float32)
+    return cent
+
+
+class IVFIndex:
+    """
+    Tunables:
+      nlist            number of coarse centroids (0 = about 4 * sqrt(rows))
+      nprobe           lists scanned per probe (recall vs. latency)
+      train_sample     max rows used for k-means training
+      retrain_fraction rebuild policy: after enroll/delete, only the new rows are assigned
+                       to the existing centroids (removed rows just leave their lists);
+                       k-means is retrained when the row count moved by more than this
+                       fraction since the last training
+      min_rows         below this many rows the exact search is used instead
+
+    Training is never done in the constructor: an index without usable centroids (or past
+    retrain_fraction) sets needs_training, keeps searching exactly (or with the old
+    centroids), and train() - slow, meant for a background thread - returns its replacement.
+    """
+    kind = "ivf"
+
+    def __init__(self, mat, row_sid, starts, n_students, prev=None, origin=None, nlist: int = 0, nprobe: int = 8,
+                 train_sample: int = 20000, retrain_fraction: float = 0.2, min_rows: int = 20000, centroids=None):
+        self.mat = mat
+        self.row_sid = row_sid
+        self.starts = starts
+        self.n_students = int(n_students)
+        self.nprobe = int(nprobe)
+        self.params = {"nlist": nlist, "nprobe": nprobe, "train_sample": train_sample,
+                       "retrain_fraction": retrain_fraction, "min_rows": min_rows}
+        self.exact = ExactIndex(mat, row_sid, starts, n_students)
+        self.centroids, self.trained_rows, self.assign = None, 0, None
+        self.needs_training = False
+        n = mat.shape[0]
+        if n < int(min_rows) or n == 0:
+            return
+        if centroids is not None:  # fresh k-means result: assign every row
+            self.centroids, self.trained_rows = centroids, n
+            self._set_lists(self._assign_rows(np.arange(n)))
+            return
+        if getattr(prev, "centroids", None) is None or origin is None:
+            self.needs_training = True  # exact search until train() is swapped in
+            return
+
+        # origin[i] = row of `prev` that row i was (-1 = new row): only new rows meet the centroids
+        self.centroids, self.trained_rows = prev.centroids, prev.trained_rows
+        origin = np.asarray(origin, dtype=np.int64)
+        assign = np.empty(n, dtype=np.int64)
+        old = origin >= 0
+        assign[old] = prev.assign[origin[old]]
+        new_rows = np.flatnonzero(~old)
+        if new_rows.size:
+            assign[new_rows] = self._assign_rows(new_rows)
+        self._set_lists(assign)
+        self.needs_training = abs(n - self.trained_rows) > float(retrain_fraction) * self.trained_rows
+
+    def _assign_rows(self, rows: np.ndarray) -> np.ndarray:
+        out = np.empty(rows.size, dtype=np.int64)
+        for s in range(0, rows.size, 65536):  # bounded temp memory for the rows x nlist similarities
+            out[s:s + 65536] = np.argmax(self.mat.dot(self.centroids, rows[s:s + 65536]), axis=0)
+        return out
+
+    def _set_lists(self, assign: np.ndarray):
+        self.assign = assign
+        self.list_rows = np.argsort(assign, kind="stable")
+        self.list_starts = np.searchsorted(assign[self.list_rows], np.arange(self.centroids.shape[0] + 1))
+
+    def train(self):
+        """k-means over (a sample of) the current rows -> a new IVFIndex on the same arrays."""
+        n = self.mat.shape[0]
+        n_lists = int(self.params["nlist"]) or int(4 * np.sqrt(n))
+        pick = None
+        if n > int(self.params["train_sample"]):
+            pick = np.sort(np.random.default_rng(0).choice(n, int(self.params["train_sample"]), replace=False))
+        cent = spherical_kmeans(self.mat.take(pick), n_lists)
+        return IVFIndex(self.mat, self.row_sid, self.starts, self.n_students, centroids=cent, **self.params)
+
+    def search(self, q: np.ndarray):
+        if self.centroids is None:
+            return self.exact.search(q)
+        k = q.shape[0]
+        idx = np.full((k, 2), -1, dtype=np.int64)
+        sims = np.full((k, 2), -1.0, dtype=np.float32)
+        nprobe = max(1, min(self.nprobe, self.centroids.shape[0]))
+        probe_lists = np.argpartition(-(q @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        for i in range(k):
+            rows = np.concatenate([self.list_rows[self.list_starts[c]:self.list_starts[c + 1]] for c in probe_lists[i]])
+            idx[i], sims[i] = _top2_per_student(self.mat.dot(q[i:i + 1], rows)[0], self.row_sid[rows])
+        return idx, sims
+
+
+def student_medoids(block: np.ndarray, m: int) -> np.ndarray:
+    """Up to m samples of one student with the highest total similarity to the others."""
+    if block.shape[0] <= m:
+        return block
+    score = (block @ block.T).sum(axis=1)
+    return block[np.sort(np.argpartition(-score, m - 1)[:m])]
+
+
+class CentroidIndex:
+    """
+    Tunables:
+      top_k    candidate students kept after the centroid pass and re-ranked exactly
+      medoids  extra representative samples per student (0 = mean embedding only)
+      verify   also run the exhaustive search, return its result and count disagreements
+               (self.checked / self.mismatches)
+    """
+    kind = "centroid"
+
+    def __init__(self, mat, row_sid, starts, n_students, top_k: int = 8, medoids: int = 0, verify: bool = False):
+        self.mat = mat
+        self.starts = starts
+        self.ends = np.append(starts[1:], mat.shape[0]).astype(np.int64)
+        self.n_students = int(n_students)
+        self.top_k = max(2, int(top_k))
+        self.verify = bool(verify)
+        self.exact = ExactIndex(mat, row_sid, starts, n_students)
+        self.checked = 0
+        self.mismatches = 0
+        if self.n_students == 0:
+            self.reps = np.empty((0, mat.shape[1]), dtype=np.float32)
+            self.rep_starts = np.empty((0,), dtype=np.int64)
+            return
+
+        counts = (self.ends - starts).astype(np.float32)
+        full = mat.take()
+        means = np.add.reduceat(full, starts, axis=0) / counts[:, None]
+        norms = np.linalg.norm(means, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        means = (means / norms).astype(np.float32)
+        if int(medoids) > 0:
+            blocks = [np.vstack([means[i:i + 1], student_medoids(full[s:e], int(medoids))])
+                      for i, (s, e) in enumerate(zip(starts, self.ends))]
+            self.rep_starts = np.concatenate([[0], np.cumsum([b.shape[0] for b in blocks])[:-1]]).astype(np.int64)
+            self.reps = np.ascontiguousarray(np.concatenate(blocks, axis=0), dtype=np.float32)
+        else:
+            self.rep_starts = np.arange(self.n_students, dtype=np.int64)
+            self.reps = means
+
+    def search(self, q: np.ndarray):
+        k = q.shape[0]
+        if self.n_students <= self.top_k or k == 0:
+            return self.exact.search(q)
+        coarse = np.maximum.reduceat(q @ self.reps.T, self.rep_starts, axis=1)
+        cand = np.argpartition(-coarse, self.top_k - 1, axis=1)[:, :self.top_k]
+        idx = np.full((k, 2), -1, dtype=np.int64)
+        sims = np.full((k, 2), -1.0, dtype=np.float32)
+        for i in range(k):
+            c = cand[i]
+            lens = self.ends[c] - self.starts[c]
+            rows = np.concatenate([np.arange(s, e) for s, e in zip(self.starts[c], self.ends[c])])
+            local = np.concatenate([[0], np.cumsum(lens)[:-1]])
+            per_student = np.maximum.reduceat(self.mat.dot(q[i:i + 1], rows)[0], local)
+            top = np.argsort(-per_student, kind="stable")[:2]
+            idx[i], sims[i] = c[top], per_student[top]
+        if self.verify:
+            ex_idx, ex_sims = self.exact.search(q)
+            self.checked += k
+            self.mismatches += int(np.count_nonzero(ex_idx[:, 0] != idx[:, 0]))
+            return ex_idx, ex_sims
+        return idx, sims
+
+
+def build_index(kind: str, mat, row_sid, starts, n_students: int, prev=None, origin=None, **params):
+    """origin: for each row, its row in prev's matrix (-1 = new), so per-row state can be carried over."""
+    kind = (kind or "exact").lower()
+    if kind == "exact":
+        return ExactIndex(mat, row_sid, starts, n_students)
+    if kind == "ivf":
+        return IVFIndex(mat, row_sid, starts, n_students, prev=prev if getattr(prev, "kind", None) == "ivf" else None,
+                        origin=origin, **params)
+    if kind == "centroid":
+        return CentroidIndex(mat, row_sid, starts, n_students, **params)
+    raise ValueError(f"Unknown match index: {kind}")
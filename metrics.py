@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Performance metrics export for the running app.
+
+Pipeline.stats_snapshot() (rolling p50/p95/p99 per stage, queue depths, drops) is
+written every `metrics_interval_sec` seconds to metrics/metrics.json and, in the
+Prometheus text format, metrics/metrics.prom (for node_exporter's textfile collector
+or a plain `cat`). overlay_lines() gives the short text drawn over the video when
+"perf_overlay" is on (F3 toggles it).
+"""
+import json
+import threading
+import time
+
+import face_db as db
+
+METRICS_DIR = db.ROOT / "metrics"
+PREFIX = "face_attendance"
+
+OVERLAY_STAGES = ("capture", "detect", "align", "feature", "match", "display", "write")
+
+
+def _num(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def to_prometheus(snap: dict, prefix: str = PREFIX) -> str:
+    out = [f"# TYPE {prefix}_stage_latency_ms summary"]
+    for stage, s in snap.items():
+        if not (isinstance(s, dict) and "p50_ms" in s):
+            continue
+        for q in ("50", "95", "99"):
+            out.append(f'{prefix}_stage_latency_ms{{stage="{stage}",quantile="0.{q}"}} {s[f"p{q}_ms"]:.4f}')
+        out.append(f'{prefix}_stage_latency_ms_sum{{stage="{stage}"}} {s["sum_ms"]:.4f}')
+        out.append(f'{prefix}_stage_latency_ms_count{{stage="{stage}"}} {s["count"]}')
+    for name in ("dropped_frames", "dropped_results", "embed_calls", "embed_reused"):
+        if name in snap:
+            out.append(f"# TYPE {prefix}_{name}_total counter")
+            out.append(f"{prefix}_{name}_total {snap[name]}")
+    for group in ("queue_depth", "scheduler", "motion_gate", "startup"):
+        values = {k: v for k, v in snap.get(group, {}).items() if _num(v)}
+        if values:
+            out.append(f"# TYPE {prefix}_{group} gauge")
+            out.extend(f'{prefix}_{group}{{name="{k}"}} {v}' for k, v in values.items())
+    return "\n".join(out) + "\n"
+
+
+def overlay_lines(snap: dict) -> list:
+    e2e = snap.get("end_to_end", {})
+    lines = [f"end-to-end p50/95/99 {e2e.get('p50_ms', 0):.0f}/{e2e.get('p95_ms', 0):.0f}/{e2e.get('p99_ms', 0):.0f} ms"]
+    for stage in OVERLAY_STAGES:
+        s = snap.get(stage, {})
+        if s.get("count"):
+            lines.append(f"{stage:<8} p50 {s['p50_ms']:6.1f}  p95 {s['p95_ms']:6.1f}  p99 {s['p99_ms']:6.1f}")
+    q = snap.get("queue_depth", {})
+    lines.append(f"queue {q.get('results', 0)}/{q.get('results_max', 0)} (peak {q.get('results_peak', 0)})  "
+                 f"dropped {snap.get('dropped_frames', 0)} frames / {snap.get('dropped_results', 0)} results")
+    return lines
+
+
+class MetricsWriter(threading.Thread):
+    """Writes snapshot_fn() to metrics.json / metrics.prom every `interval` seconds."""
+    def __init__(self, snapshot_fn, interval: float = 10.0, out_dir=METRICS_DIR):
+        super().__init__(name="metrics", daemon=True)
+        self.snapshot_fn = snapshot_fn
+        self.interval = max(1.0, float(interval))
+        self.out_dir = out_dir
+        self._stop_event = threading.Event()
+
+    def write_once(self):
+        snap = self.snapshot_fn()
+        snap["time"] = time.time()
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        db.atomic_write_text(self.out_dir / "metrics.json", json.dumps(snap, indent=2))
+        db.atomic_write_text(self.out_dir / "metrics.prom", to_prometheus(snap))
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.write_once()
+            except Exception:
+                pass  # metrics must never take the app down
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,624 @@
+# -*- coding: utf-8 -*-
+"""
+Background camera pipeline:
+  capture thread  -> keeps only the freshest frame (older ones are dropped)
+  inference worker -> detection / recognition / matching (FrameProcessor)
+  result queue    -> drained by the Tk thread for display and recording
+The same FrameProcessor / AttendanceRecorder also drive replay.py (headless, recorded video).
+"""
+import collections
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import cv_engine as eng
+import face_db as db
+
+
+class StageStats:
+    """
+    Latency counters for one pipeline stage (ewma = exponentially weighted recent average).
+    The last `window` samples are kept for percentiles (window=None keeps all of them).
+    """
+    EWMA_ALPHA = 0.2
+
+    def __init__(self, window: int | None = 1024):
+        self._lock = threading.Lock()
+        self.samples = collections.deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+        self.ewma = 0.0
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.count += 1
+            self.samples.append(seconds)
+            self.total += seconds
+            self.last = seconds
+            if seconds > self.max:
+                self.max = seconds
+            self.ewma = seconds if self.count == 1 else self.ewma + self.EWMA_ALPHA * (seconds - self.ewma)
+
+    def percentiles(self, qs=(50, 95, 99)) -> dict:
+        with self._lock:
+            a = np.asarray(self.samples, dtype=np.float64)
+        if a.size == 0:
+            return {f"p{q}_ms": 0.0 for q in qs}
+        return {f"p{q}_ms": 1000.0 * v for q, v in zip(qs, np.percentile(a, qs))}
+
+    def snapshot(self):
+        with self._lock:
+            avg = self.total / self.count if self.count else 0.0
+            snap = {
+                "count": self.count,
+                "sum_ms": 1000.0 * self.total,
+                "last_ms": 1000.0 * self.last,
+                "avg_ms": 1000.0 * avg,
+                "max_ms": 1000.0 * self.max,
+                "ewma_ms": 1000.0 * self.ewma,
+            }
+        snap.update(self.percentiles())
+        return snap
+
+
+# embed = align (alignCrop) + feature; write = attendance row append (Tk thread)
+STAGES = ("capture", "detect", "align", "feature", "embed", "match", "inference", "queue", "display", "write",
+          "end_to_end")
+
+# Tracked faces are re-embedded when their match is weaker than threshold + margin,
+# and in any case after REEMBED_SEC (guards against a track switching people).
+CONFIDENT_MARGIN = 0.10
+REEMBED_SEC = 10.0
+
+
+class AdaptiveScheduler:
+    """
+    Fits the work to the machine from measured stage costs:
+      - detection interval = inference cost / cpu_budget, stretched while the
+        end-to-end latency of displayed frames is above target; frames in between
+        are passed straight to the display (with the last boxes),
+      - capture cadence: faces are not re-sampled faster than detection runs,
+      - display interval: _show_frame may use at most half of the Tk thread.
+    Detection frequency is always lowered first, so the display keeps the camera's pace.
+    """
+    MAX_LATENCY_FACTOR = 8.0
+
+    def __init__(self, stats: dict, target_latency_ms: float = 150.0, cpu_budget: float = 0.5,
+                 min_display_ms: int = 15, max_display_ms: int = 100):
+        self.stats = stats
+        self.target_latency = target_latency_ms / 1000.0
+        self.cpu_budget = cpu_budget
+        self.min_display_ms = int(min_display_ms)
+        self.max_display_ms = int(max_display_ms)
+        self.latency_factor = 1.0
+        self.detect_interval = 0.0
+        self._last_detect_t = 0.0
+
+    def configure(self, target_latency_ms: float, cpu_budget: float):
+        self.target_latency = max(0.001, float(target_latency_ms) / 1000.0)
+        self.cpu_budget = min(1.0, max(0.05, float(cpu_budget)))
+
+    def should_detect(self, now: float) -> bool:
+        if now - self._last_detect_t >= self.detect_interval:
+            self._last_detect_t = now
+            return True
+        return False
+
+    def update(self):
+        """Call after each inference frame."""
+        if self.stats["end_to_end"].ewma > self.target_latency:
+            self.latency_factor = min(self.MAX_LATENCY_FACTOR, self.latency_factor * 1.25)
+        else:
+            self.latency_factor = max(1.0, self.latency_factor * 0.95)
+        self.detect_interval = self.latency_factor * self.stats["inference"].ewma / self.cpu_budget
+
+    def capture_interval(self, configured: float) -> float:
+        return max(float(configured), self.detect_interval)
+
+    def display_interval_ms(self) -> int:
+        cost_ms = 1000.0 * self.stats["display"].ewma
+        return int(min(self.max_display_ms, max(self.min_display_ms, 2.0 * cost_ms)))
+
+    def snapshot(self):
+        return {
+            "detect_interval_ms": 1000.0 * self.detect_interval,
+            "latency_factor": self.latency_factor,
+            "display_interval_ms": self.display_interval_ms(),
+        }
+
+
+class CaptureThread(threading.Thread):
+    """Reads the camera as fast as it delivers and keeps only the newest frame.
+
+    pace(), if given, is called before each read (replay sources sleep there to keep
+    their frame rate) so that the wait is not counted as capture time.
+    """
+    def __init__(self, cap, stats: dict, pace=None):
+        super().__init__(name="capture", daemon=True)
+        self.cap = cap
+        self.stats = stats
+        self.pace = pace
+        self.dropped = 0
+        self._cond = threading.Condition()
+        self._frame = None
+        self._t_frame = 0.0
+        self._seq = 0
+        self._taken_seq = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            if self.cap is None or not self.cap.isOpened():
+                time.sleep(0.2)
+                continue
+            if self.pace is not None:
+                self.pace()
+            t0 = time.perf_counter()
+            ret, frame = self.cap.read()
+            t1 = time.perf_counter()
+            if not ret:
+                time.sleep(0.01)
+                continue
+            self.stats["capture"].add(t1 - t0)
+            with self._cond:
+                if self._seq > self._taken_seq:
+                    self.dropped += 1
+                self._frame = frame
+                self._t_frame = t1  # end_to_end starts when the frame is in hand
+                self._seq += 1
+                self._cond.notify_all()
+
+    def latest(self, timeout: float = 0.5):
+        """Wait for a frame newer than the last one taken -> (frame, t_frame) or (None, 0.0)."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > self._taken_seq or self._stop_event.is_set(), timeout):
+                return None, 0.0
+            if self._seq == self._taken_seq:
+                return None, 0.0
+            self._taken_seq = self._seq
+            return self._frame, self._t_frame
+
+    def pending(self) -> int:
+        """1 when a frame is waiting for the inference worker."""
+        with self._cond:
+            return int(self._seq > self._taken_seq)
+
+    def stop(self):
+        self._stop_event.set()
+        with self._cond:
+            self._cond.notify_all()
+
+
+def frame_params(cfg: dict, mode, session=0, face_score=None, interval=None, sim_th=None) -> dict:
+    """
+    The per-frame settings FrameProcessor / Pipeline read, from config.json. The app (its
+    Tk controls) and replay.py (command line) only override the face score, capture
+    interval and similarity threshold, so both run with the same settings.
+    """
+    enroll = mode == "enroll"
+    return {
+        "mode": mode,
+        "session": session,
+        "face_score": float(cfg.get("default_face_score_threshold", 0.90) if face_score is None else face_score),
+        "interval": float(cfg.get("capture_interval_sec", 2.0) if interval is None else interval),
+        "sim_th": float(cfg.get("default_similarity_threshold", 0.50) if sim_th is None else sim_th),
+        "detect_long_side": int(cfg.get("detect_long_side", 0)),
+        "nms": float(cfg.get("detect_nms_enroll" if enroll else "detect_nms_attendance", 0.3)),
+        "top_k": int(cfg.get("detect_top_k_enroll" if enroll else "detect_top_k_attendance", 0)),
+        "motion_sensitivity": float(cfg.get("motion_sensitivity", 3.0)),
+        "motion_idle_detect_sec": float(cfg.get("motion_idle_detect_sec", 2.0)),
+        "target_latency_ms": float(cfg.get("target_latency_ms", 150.0)),
+        "cpu_budget": float(cfg.get("cpu_budget", 0.5)),
+        "embed_workers": int(cfg.get("embed_workers", 0)),
+        "batch_embed": bool(cfg.get("batch_embed", True)),
+    }
+
+
+class FrameProcessor:
+    """
+    Detection, feature extraction and matching for one frame.
+    Runs on the inference worker; `params` is a plain dict snapshot taken on the Tk thread.
+    `clock` (seconds) paces captures and re-embedding; replay.py passes the video time.
+    """
+    def __init__(self, gallery, stats: dict, clock=time.time):
+        self.gallery = gallery
+        self.stats = stats
+        self.clock = clock
+        self.detector = None
+        self.recognizer = None
+        self.last_capture_t = 0.0
+        self._session = None
+        self.tracker = eng.FaceTracker()
+        self.gate = eng.MotionGate()
+        self._had_faces = False
+        self.last_faces = []
+        self._last_faces_t = 0.0
+        self.embed_calls = 0
+        self.embed_reused = 0
+        self.embed_pool = None
+        self.use_batch_embedder = True
+        self.batch_embedder = None
+        self._batch_verified = False
+        self._engine_lock = threading.Lock()  # EngineLoader may be creating the models
+        self.warmed_up = False
+
+    def ensure_pool(self, workers: int):
+        """Process pool for multi-face frames (workers <= 0: embed in this thread)."""
+        workers = int(workers)
+        if self.embed_pool is not None and self.embed_pool.workers != workers:
+            self.close_pool()
+        if self.embed_pool is None and workers > 0:
+            self.embed_pool = eng.EmbeddingPool(workers)
+
+    def close_pool(self):
+        if self.embed_pool is not None:
+            self.embed_pool.close()
+            self.embed_pool = None
+
+    def _embed(self, bgr, face_rows):
+        t0 = time.perf_counter()
+        crops = eng.align_faces(self.recognizer, bgr, face_rows)
+        t1 = time.perf_counter()
+        feats = self._features(crops)
+        t2 = time.perf_counter()
+        self.stats["align"].add(t1 - t0)
+        self.stats["feature"].add(t2 - t1)
+        self.stats["embed"].add(t2 - t0)
+        return feats
+
+    def _features(self, crops):
+        if len(crops) > 1 and self.embed_pool is not None:
+            feats, _ = self.embed_pool.embed(crops)
+            return list(feats)
+        if len(crops) > 1 and self.use_batch_embedder and self.batch_embedder is not None:
+            if not self._batch_verified:
+                # first batch: check against FaceRecognizerSF once, stay on the per-face path if it differs
+                if not eng.verify_batch_embedder(self.batch_embedder, self.recognizer, crops):
+                    self.batch_embedder = None
+                    return [eng.crop_feature(self.recognizer, c) for c in crops]
+                self._batch_verified = True
+            return list(self.batch_embedder.embed(crops))
+        return [eng.crop_feature(self.recognizer, c) for c in crops]
+
+    def ensure_engine(self, face_score_th: float, long_side: int = 0, batch_embed: bool = True):
+        """
+        Models are created once; a threshold below the network's (< DETECTOR_MIN_SCORE) rebuilds it.
+        The batched SFace net only exists while batch_embed is on (created / dropped when it changes).
+        """
+        with self._engine_lock:
+            face_score_th = float(face_score_th)
+            batch_embed = bool(batch_embed)
+            if self.detector is None or face_score_th < self.detector.net_score:
+                self.detector = eng.make_detector(score_thresh=face_score_th, long_side=long_side)
+            self.detector.long_side = int(long_side)
+            created = self.recognizer is None
+            if created:
+                self.recognizer = eng.make_recognizer()
+            if created or batch_embed != self.use_batch_embedder:
+                self.use_batch_embedder = batch_embed
+                self.batch_embedder = eng.BatchEmbedder() if batch_embed else None
+                self._batch_verified = False
+
+    def warm_up(self, frame_size=(640, 480)):
+        """One detection and one (batched) embedding on blank input, so the first real frame
+        does not pay for OpenCV's lazy network allocation."""
+        with self._engine_lock:
+            w, h = frame_size
+            eng.detect_faces(self.detector, np.zeros((int(h), int(w), 3), dtype=np.uint8))
+            crop = np.zeros((112, 112, 3), dtype=np.uint8)
+            eng.crop_feature(self.recognizer, crop)
+            if self.use_batch_embedder and self.batch_embedder is not None:
+                self.batch_embedder.embed([crop, crop])
+            self.warmed_up = True
+
+    def process(self, bgr, params: dict):
+        """Returns (display_frame, feats, code, matches)."""
+        mode = params.get("mode")
+        if params.get("session") != self._session:
+            self._session = params.get("session")
+            self.last_capture_t = 0.0
+            self.tracker.reset()
+            self.gate.reset()
+
+        face_score = float(params["face_score"])
+        self.ensure_engine(face_score, int(params.get("detect_long_side", 0)), params.get("batch_embed", True))
+        self.ensure_pool(int(params.get("embed_workers", 0)))
+
+        # --- Motion gate: an empty, static scene does not need detection ---
+        if mode == "attendance" and not self._had_faces:
+            self.gate.sensitivity = float(params.get("motion_sensitivity", self.gate.sensitivity))
+            self.gate.idle_detect_sec = float(params.get("motion_idle_detect_sec", self.gate.idle_detect_sec))
+            if not self.gate.should_detect(bgr, self.clock()):
+                return bgr, [], "IDLE", []
+
+        # --- Detection (once per frame) ---
+        t0 = time.perf_counter()
+        faces_mat = eng.detect_faces(self.detector, bgr, face_score, params.get("nms"),
+                                     int(params.get("top_k", 0)) or None)
+        self.stats["detect"].add(time.perf_counter() - t0)
+        if mode == "attendance":
+            # prefer largest faces, cap to keep CPU reasonable
+            return self._attendance(bgr, eng.select_faces(faces_mat, face_score, max_faces=5), params)
+
+        face = eng.pick_largest_face(faces_mat)
+        faces = [] if face is None else [face]
+        self._remember_faces(faces)
+        if face is None:
+            return bgr, None, "NO_FACE", []
+
+        # --- Rate limit captures: only embed when a sample is actually taken ---
+        now = self.clock()
+        capture = now - self.last_capture_t >= float(params["interval"])
+        feats = []
+        if capture:
+            self.last_capture_t = now
+            feats = self._embed(bgr, faces)
+
+        # The worker owns this frame, so boxes go straight into it (after alignment read the pixels)
+        eng.draw_face_boxes(bgr, faces, color=(0, 255, 0))
+        if not capture:
+            return bgr, None, "OK_WAIT", []
+        return bgr, feats[0], "OK_CAPTURE", []
+
+    def _remember_faces(self, faces):
+        self.last_faces = list(faces)
+        self._last_faces_t = self.clock()
+
+    def draw_last_faces(self, bgr, max_age: float = 1.0):
+        """Frames that skip detection still show the most recent boxes."""
+        if self.last_faces and self.clock() - self._last_faces_t <= max_age:
+            eng.draw_face_boxes(bgr, self.last_faces, color=(0, 255, 0))
+        return bgr
+
+    def _needs_embedding(self, track, now: float, params: dict) -> bool:
+        if track.feat is None:
+            return True
+        if now - track.last_embed_t < float(params["interval"]):
+            return False
+        if track.sid is None or track.sim < float(params["sim_th"]) + CONFIDENT_MARGIN:
+            return True
+        return now - track.last_embed_t >= REEMBED_SEC
+
+    def _attendance(self, bgr, faces, params: dict):
+        """
+        Track faces across frames and embed only new tracks, low-confidence tracks
+        (at the capture interval) and tracks due for a periodic re-check.
+        Matches are returned only for faces embedded in this frame.
+        """
+        tracks = self.tracker.update(faces)
+        self._had_faces = len(faces) > 0
+        self._remember_faces(faces)
+        if len(faces) == 0:
+            return bgr, [], "NO_FACE", []
+
+        now = self.clock()
+        due = [t for t in tracks if self._needs_embedding(t, now, params)]
+        self.embed_reused += len(tracks) - len(due)
+        feats = []
+        if due:
+            feats = self._embed(bgr, [t.face for t in due])
+            self.embed_calls += len(due)
+
+        eng.draw_face_boxes(bgr, faces, color=(0, 255, 0))
+        if not due:
+            return bgr, [], "OK_WAIT", []
+
+        t0 = time.perf_counter()
+        matches = self.gallery.match_batch(np.stack(feats), float(params["sim_th"]))
+        self.stats["match"].add(time.perf_counter() - t0)
+        for t, f, (sid, sim, margin) in zip(due, feats, matches):
+            t.feat, t.sid, t.sim, t.margin, t.last_embed_t = f, sid, sim, margin, now
+        return bgr, feats, "OK_CAPTURE", matches
+
+
+class EngineLoader(threading.Thread):
+    """
+    Loads (downloading if missing) and warms up YuNet/SFace while the UI is already up.
+    A frame arriving meanwhile waits on the processor's engine lock instead of loading twice.
+    The warm-up runs at the camera's real frame size (detector downscaling included):
+    with frame_size=None it waits for set_frame_size(), or SIZE_WAIT_S, after loading.
+    """
+    DEFAULT_SIZE = (640, 480)
+    SIZE_WAIT_S = 10.0
+
+    def __init__(self, processor: FrameProcessor, face_score: float, long_side: int = 0, frame_size=None,
+                 batch_embed: bool = True):
+        super().__init__(name="engine-loader", daemon=True)
+        self.processor = processor
+        self.face_score = face_score
+        self.long_side = long_side
+        self.batch_embed = batch_embed
+        self.frame_size = frame_size
+        self.error = None
+        self.load_s = 0.0
+        self.warmup_s = 0.0
+        self.done = threading.Event()
+        self._size_known = threading.Event()
+        if frame_size is not None:
+            self._size_known.set()
+
+    def set_frame_size(self, frame_size):
+        """(width, height) of the opened camera; None = unknown (warm up at DEFAULT_SIZE)."""
+        if frame_size is not None:
+            self.frame_size = frame_size
+        self._size_known.set()
+
+    def run(self):
+        try:
+            t0 = time.perf_counter()
+            eng.ensure_models()
+            self.processor.ensure_engine(self.face_score, self.long_side, self.batch_embed)
+            t1 = time.perf_counter()
+            self._size_known.wait(self.SIZE_WAIT_S)
+            t2 = time.perf_counter()
+            self.processor.warm_up(self.frame_size or self.DEFAULT_SIZE)
+            self.load_s, self.warmup_s = t1 - t0, time.perf_counter() - t2
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.done.set()
+
+
+class AttendanceRecorder:
+    """
+    Turns matches into attendance rows, at most one per student per cooldown.
+    `write` is face_db.append_attendance_row in the app (None = only return the event);
+    `clock` returns a datetime; write times go to stats["write"] when `stats` is given.
+    """
+    def __init__(self, gallery, default_class: str, cooldown_hours: float = 12.0, last_recorded: dict | None = None,
+                 write=db.append_attendance_row, clock=datetime.now, stats: dict | None = None):
+        self.gallery = gallery
+        self.stats = stats
+        self.default_class = default_class
+        self.cooldown_hours = float(cooldown_hours)
+        self.last_recorded = {} if last_recorded is None else last_recorded
+        self.write = write
+        self.clock = clock
+
+    def record(self, sid, sim: float) -> dict:
+        """-> {"status": "UNKNOWN" | "COOLDOWN" | "RECORDED", "sid", "name", "class", "sim", "time"}"""
+        now = self.clock()
+        if sid is None:
+            return {"status": "UNKNOWN", "sid": None, "name": "", "class": "", "sim": float(sim), "time": now}
+        info = self.gallery.meta.get(sid, {})
+        event = {"status": "RECORDED", "sid": sid, "name": info.get("name", ""),
+                 "class": info.get("class", self.default_class), "sim": float(sim), "time": now}
+        last = self.last_recorded.get(sid)
+        if last is not None and now - last < timedelta(hours=self.cooldown_hours):
+            event["status"] = "COOLDOWN"
+            return event
+        if self.write is not None:
+            t0 = time.perf_counter()
+            self.write(event["class"], sid, event["name"], sim)
+            if self.stats is not None:
+                self.stats["write"].add(time.perf_counter() - t0)
+        self.last_recorded[sid] = now
+        return event
+
+
+DISPLAY_ONLY = (None, "SKIP", "IDLE", "NO_FACE", "OK_WAIT")  # result codes that only carry a frame to show
+
+
+class Pipeline:
+    """Owns the capture thread and the inference worker; the Tk thread only calls set_params() and drain()."""
+    def __init__(self, cap, gallery, max_results: int = 8, clock=time.time, stats_window: int | None = 1024,
+                 pace=None):
+        self.stats = {name: StageStats(stats_window) for name in STAGES}
+        self.capture = CaptureThread(cap, self.stats, pace=pace)
+        self.processor = FrameProcessor(gallery, self.stats, clock=clock)
+        self.scheduler = AdaptiveScheduler(self.stats)
+        self.results = collections.deque()
+        self.max_results = int(max_results)
+        self._results_lock = threading.Lock()
+        self.result_depth = collections.deque(maxlen=1024)  # queue length seen by each put
+        self.dropped_results = 0
+        self.loader = None
+        self.startup = {}  # seconds since process start, filled in by the app
+        self._params = {"mode": None, "session": 0}
+        self._params_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="inference", daemon=True)
+
+    def start(self):
+        self.capture.start()
+        self._worker.start()
+
+    def preload(self, face_score: float, long_side: int = 0, frame_size=None, batch_embed: bool = True):
+        """Start loading the models in the background (see EngineLoader)."""
+        self.loader = EngineLoader(self.processor, face_score, long_side, frame_size, batch_embed)
+        self.loader.start()
+
+    def set_frame_size(self, frame_size):
+        """Report the camera's frame size to a running preload (None = camera unavailable)."""
+        if self.loader is not None:
+            self.loader.set_frame_size(frame_size)
+        return self.loader
+
+    def stop(self, timeout: float = 1.0):
+        self._stop.set()
+        self.capture.stop()
+        self._worker.join(timeout)
+        self.capture.join(timeout)
+        self.processor.close_pool()
+
+    def set_params(self, params: dict):
+        with self._params_lock:
+            self._params = dict(params)
+
+    def _put(self, result: dict):
+        """
+        Queue a result. When max_results are waiting, the oldest display-only result
+        makes room; captures (matches, enrollment samples) and errors are never dropped,
+        so a busy Tk thread delays them but cannot lose them.
+        """
+        with self._results_lock:
+            self.result_depth.append(len(self.results))
+            if len(self.results) >= self.max_results:
+                victim = next((i for i, r in enumerate(self.results) if r["code"] in DISPLAY_ONLY), None)
+                if victim is not None:
+                    del self.results[victim]
+                    self.dropped_results += 1
+                elif result["code"] in DISPLAY_ONLY:
+                    self.dropped_results += 1  # only captures are waiting: drop this frame instead
+                    return
+            self.results.append(result)
+
+    def _run(self):
+        while not self._stop.is_set():
+            frame, t_frame = self.capture.latest(timeout=0.5)
+            if frame is None:
+                continue
+            with self._params_lock:
+                params = self._params
+            result = {"frame": frame, "mode": params.get("mode"), "session": params.get("session"),
+                      "code": None, "feats": None, "matches": [], "t_frame": t_frame}
+            if result["mode"] in ("enroll", "attendance"):
+                self.scheduler.configure(params.get("target_latency_ms", 150.0), params.get("cpu_budget", 0.5))
+                t0 = time.perf_counter()
+                if self.scheduler.should_detect(t0):
+                    params = dict(params, interval=self.scheduler.capture_interval(params["interval"]))
+                    try:
+                        disp, feats, code, matches = self.processor.process(frame, params)
+                        result.update(frame=disp, feats=feats, code=code, matches=matches)
+                    except Exception as e:
+                        result.update(code="ERROR", error=str(e))
+                        time.sleep(0.5)
+                    self.stats["inference"].add(time.perf_counter() - t0)
+                    self.scheduler.update()
+                else:
+                    result.update(frame=self.processor.draw_last_faces(frame), code="SKIP")
+            result["t_ready"] = time.perf_counter()
+            self._put(result)
+
+    def drain(self):
+        """All results produced since the last call (Tk thread)."""
+        with self._results_lock:
+            out = list(self.results)
+            self.results.clear()
+        now = time.perf_counter()
+        for r in out:
+            self.stats["queue"].add(now - r["t_ready"])
+        return out
+
+    def stats_snapshot(self):
+        snap = {name: s.snapshot() for name, s in self.stats.items()}
+        depth = list(self.result_depth)
+        snap["queue_depth"] = {
+            "results": len(self.results),
+            "results_max": self.max_results,
+            "results_avg": float(np.mean(depth)) if depth else 0.0,
+            "results_peak": max(depth) if depth else 0,
+            "capture_pending": self.capture.pending(),
+        }
+        snap["dropped_frames"] = self.capture.dropped
+        snap["dropped_results"] = self.dropped_results
+        snap["embed_calls"] = self.processor.embed_calls
+        snap["embed_reused"] = self.processor.embed_reused
+        snap["motion_gate"] = self.processor.gate.snapshot()
+        snap["scheduler"] = self.scheduler.snapshot()
+        snap["startup"] = dict(self.startup)
+        return snap
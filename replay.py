@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Headless replay: run the attendance pipeline on a recorded video or an image folder.
+
+  python replay.py class.mp4                       # every frame, as fast as possible
+  python replay.py class.mp4 --speed 1             # live behaviour at the video's frame rate
+  python replay.py frames/ --fps 15 --speed 4      # image sequence, 4x faster than real time
+  python replay.py class.mp4 --json report.json --write-logs /tmp/att
+
+Detection, embedding, matching and the cooldown are the app's own (pipeline.FrameProcessor
+and pipeline.AttendanceRecorder), clocked by the video time, so cooldowns and capture
+intervals behave as in the classroom at any replay speed.
+  --speed 0  every frame goes through FrameProcessor in this thread (no scheduler, no drops)
+  --speed S  the threaded Pipeline reads the source paced at S x its frame rate, dropping
+             frames and stretching detection like the live app
+No camera or display is needed. Attendance rows are only written with --write-logs.
+"""
+import argparse
+import collections
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import config_store as cfgs
+import cv_engine as eng
+import face_db as db
+import pipeline as pl
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+class FrameSource:
+    """cv2.VideoCapture-like reader over a video file or an image folder that tracks the video time."""
+    def __init__(self, path: Path, fps: float = 0.0, speed: float = 0.0, max_frames: int = 0):
+        self.path = Path(path)
+        self.cap = None
+        self.images = None
+        if self.path.is_dir():
+            self.images = sorted(p for p in self.path.iterdir() if p.suffix.lower() in IMAGE_EXTS)
+            self.fps = float(fps) or 10.0
+        else:
+            self.cap = cv2.VideoCapture(str(self.path))
+            self.fps = float(fps) or float(self.cap.get(cv2.CAP_PROP_FPS) or 0.0) or 25.0
+        self.speed = float(speed)
+        self.max_frames = int(max_frames)
+        self.index = 0
+        self.video_t = 0.0
+        self.finished = False
+        self._t0 = None
+
+    def isOpened(self):
+        if self.finished:
+            return False
+        return self.images is not None or (self.cap is not None and self.cap.isOpened())
+
+    def wait_next(self):
+        """Sleep until the next frame is due at `speed` x the frame rate (no-op when speed is 0)."""
+        if self.speed <= 0:
+            return
+        now = time.perf_counter()
+        if self._t0 is None:
+            self._t0 = now
+        wait = self._t0 + self.index / (self.fps * self.speed) - now
+        if wait > 0:
+            time.sleep(wait)
+
+    def read(self):
+        if self.finished or (self.max_frames and self.index >= self.max_frames):
+            self.finished = True
+            return False, None
+        if self.images is not None:
+            frame = None
+            if self.index < len(self.images):
+                frame = cv2.imdecode(np.fromfile(str(self.images[self.index]), dtype=np.uint8), cv2.IMREAD_COLOR)
+            ok = frame is not None
+        else:
+            ok, frame = self.cap.read()
+        if not ok:
+            self.finished = True
+            return False, None
+        self.video_t = self.index / self.fps
+        self.index += 1
+        return True, frame
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+
+
+class Replay:
+    def __init__(self, source: FrameSource, gallery, params: dict, recorder_kwargs: dict, verbose: bool = True):
+        self.source = source
+        self.gallery = gallery
+        self.params = params
+        self.verbose = verbose
+        self.codes = collections.Counter()
+        self.events = []
+        self._wall0 = time.time()
+        self._start_dt = datetime.now()
+        self.recorder = pl.AttendanceRecorder(gallery, clock=self.video_datetime, **recorder_kwargs)
+
+    def video_clock(self) -> float:
+        return self._wall0 + self.source.video_t
+
+    def video_datetime(self) -> datetime:
+        return self._start_dt + timedelta(seconds=self.source.video_t)
+
+    def _handle(self, code, matches):
+        self.codes[code] += 1
+        if code != "OK_CAPTURE":
+            return
+        for sid, sim, margin in matches:
+            ev = self.recorder.record(sid, sim)
+            row = {"video_t": round(self.source.video_t, 3), "frame": self.source.index - 1,
+                   "status": ev["status"], "sid": ev["sid"], "name": ev["name"], "class": ev["class"],
+                   "sim": round(ev["sim"], 4), "margin": round(float(margin), 4)}
+            self.events.append(row)
+            if self.verbose and ev["status"] == "RECORDED":
+                m, sec = divmod(row["video_t"], 60)
+                print(f"[{int(m):02d}:{sec:04.1f}] RECORDED  {ev['sid']:<12} {ev['name']} ({ev['sim']:.3f})")
+
+    def run_sequential(self):
+        """Every frame through FrameProcessor on this thread."""
+        stats = {name: pl.StageStats(window=None) for name in pl.STAGES}
+        proc = pl.FrameProcessor(self.gallery, stats, clock=self.video_clock)
+        try:
+            while True:
+                t0 = time.perf_counter()
+                ok, frame = self.source.read()
+                if not ok:
+                    break
+                stats["capture"].add(time.perf_counter() - t0)
+                t1 = time.perf_counter()
+                _, _, code, matches = proc.process(frame, self.params)
+                stats["inference"].add(time.perf_counter() - t1)
+                self._handle(code, matches)
+                stats["end_to_end"].add(time.perf_counter() - t0)
+        finally:
+            proc.close_pool()
+        extra = {"embed_calls": proc.embed_calls, "embed_reused": proc.embed_reused, "motion_gate": proc.gate.snapshot()}
+        return stats, time.perf_counter(), extra
+
+    def run_paced(self, drain_interval: float = 0.01, idle_grace: float = 1.0):
+        """The threaded Pipeline, fed at source.speed x the frame rate."""
+        pipe = pl.Pipeline(self.source, self.gallery, clock=self.video_clock, stats_window=None,
+                           pace=self.source.wait_next)
+        pipe.set_params(self.params)
+        pipe.start()
+        last_result = time.perf_counter()
+        try:
+            while True:
+                for r in pipe.drain():
+                    last_result = time.perf_counter()
+                    pipe.stats["end_to_end"].add(last_result - r["t_frame"])
+                    self._handle(r["code"], r["matches"])
+                if self.source.finished and time.perf_counter() - last_result > idle_grace:
+                    break
+                time.sleep(drain_interval)
+        finally:
+            pipe.stop()
+        snap = pipe.stats_snapshot()
+        extra = {k: snap[k] for k in ("dropped_frames", "dropped_results", "embed_calls", "embed_reused",
+                                      "motion_gate", "scheduler")}
+        return pipe.stats, last_result, extra
+
+    def run(self) -> dict:
+        t0 = time.perf_counter()
+        if self.source.speed > 0:
+            stats, t_end, extra = self.run_paced()
+        else:
+            stats, t_end, extra = self.run_sequential()
+        wall = t_end - t0
+        frames = self.source.index
+        video_s = frames / self.source.fps
+        status = collections.Counter(e["status"] for e in self.events)
+        return {
+            "source": str(self.source.path),
+            "mode": f"paced x{self.source.speed:g}" if self.source.speed > 0 else "sequential",
+            "frames": frames,
+            "source_fps": self.source.fps,
+            "video_s": round(video_s, 3),
+            "wall_s": round(wall, 3),
+            "throughput_fps": round(frames / wall, 2) if wall > 0 else 0.0,
+            "realtime_factor": round(video_s / wall, 2) if wall > 0 else 0.0,
+            "codes": dict(self.codes),
+            "stages": {name: s.snapshot() for name, s in stats.items() if s.count},
+            **extra,
+            "events_summary": {"recorded": status["RECORDED"], "cooldown": status["COOLDOWN"],
+                               "unknown": status["UNKNOWN"], "students": len(self.recorder.last_recorded)},
+            "events": self.events,
+        }
+
+
+def print_report(rep: dict):
+    print(f"{rep['source']} [{rep['mode']}]: {rep['frames']} frame(s), {rep['video_s']:.1f}s of video "
+          f"in {rep['wall_s']:.1f}s -> {rep['throughput_fps']:.1f} fps ({rep['realtime_factor']:.2f}x real time)")
+    print(f"{'stage':<12} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, s in rep["stages"].items():
+        print(f"{name:<12} {s['count']:>7} {s['p50_ms']:>9.2f} {s['p95_ms']:>9.2f} {s['p99_ms']:>9.2f} {s['max_ms']:>9.2f}")
+    print("frames by result: " + ", ".join(f"{k}={v}" for k, v in sorted(rep["codes"].items(), key=str)))
+    ev = rep["events_summary"]
+    print(f"events: {ev['recorded']} recorded ({ev['students']} student(s)), {ev['cooldown']} cooldown, "
+          f"{ev['unknown']} unknown; embeddings {rep['embed_calls']} computed / {rep['embed_reused']} reused")
+    if "dropped_frames" in rep:
+        print(f"dropped: {rep['dropped_frames']} frame(s), {rep['dropped_results']} result(s)")
+
+
+def main():
+    cfg = cfgs.load_config()
+    ap = argparse.ArgumentParser(description="Run the attendance pipeline headless on a recording")
+    ap.add_argument("source", type=Path, help="video file or folder of images (sorted by name)")
+    ap.add_argument("--speed", type=float, default=0.0,
+                    help="0 = every frame as fast as possible; S > 0 = threaded pipeline at S x real time")
+    ap.add_argument("--fps", type=float, default=0.0, help="source frame rate (default: from the video, 10 for images)")
+    ap.add_argument("--max-frames", type=int, default=0)
+    ap.add_argument("--class", dest="cls", default=cfg.get("default_class_name", "OS_Lab"),
+                    help="class for students without one")
+    ap.add_argument("--cooldown", type=float, default=float(cfg.get("cooldown_hours", 12.0)), help="hours")
+    ap.add_argument("--score", type=float, help="face score threshold (default: config)")
+    ap.add_argument("--sim", type=float, help="similarity threshold (default: config)")
+    ap.add_argument("--db", type=Path, help="faces_db folder to match against (default: the app's)")
+    ap.add_argument("--write-logs", type=Path, help="also write attendance CSVs to this folder")
+    ap.add_argument("--json", type=Path, help="write the full report (with every event) here")
+    ap.add_argument("--quiet", action="store_true", help="do not print events as they happen")
+    args = ap.parse_args()
+
+    if not args.source.exists():
+        print(f"Not found: {args.source}")
+        return 2
+    eng.ensure_models()
+    if args.db or args.write_logs:
+        db.set_data_dirs(db_dir=args.db, log_dir=args.write_logs)
+    gallery = db.Gallery.from_config(cfg)
+    gallery.wait_for_index()  # match with the trained index from the first frame
+    recorder_kwargs = {"default_class": args.cls, "cooldown_hours": args.cooldown,
+                       "write": db.append_attendance_row if args.write_logs else None}
+    source = FrameSource(args.source, fps=args.fps, speed=args.speed, max_frames=args.max_frames)
+    if not source.isOpened():
+        print(f"Cannot open: {args.source}")
+        return 2
+    print(f"{len(gallery)} enrolled student(s), {source.fps:g} fps source")
+    params = pl.frame_params(cfg, "attendance", session=1, face_score=args.score, sim_th=args.sim)
+    try:
+        rep = Replay(source, gallery, params, recorder_kwargs, verbose=not args.quiet).run()
+    finally:
+        source.release()
+        db.close_attendance()
+    print_report(rep)
+    if args.json:
+        args.json.write_text(json.dumps(rep, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Report -> {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())